@@ -1,59 +1,220 @@
+import os
+import csv
+import sqlite3
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment, NamedStyle
+from openpyxl.utils import get_column_letter
 from openpyxl.drawing.image import Image
 from datetime import datetime
+from itertools import chain
 
 # Load data from output.txt with correct header row
 file_path = 'output.txt'
+# Typed result store written by the crawler next to output.txt, used when it exists
+result_db = 'results.db'
+# The store keeps every run's results, only the Strike IDs of this input file are reported
+input_file_path = 'input.txt'
+# Rows of output.txt parsed at a time, None reads it at once
+chunk_size = None
 
-# Read the data with a single header
-data = pd.read_csv(file_path, sep='\t', dtype=str, header=0)  # Use the first row as header
 
-# Remove duplicate headers if they exist within the file data
-data = data.loc[~data.apply(lambda row: row.str.contains('Strike ID').any(), axis=1)]
+def read_input_strike_ids(path):
+    """Strike IDs of the input file, the first column of every line."""
+    with open(path, 'rb') as f:
+        return {line.split(b'\t', 1)[0].decode('utf8', errors='ignore').strip() for line in f if line.strip()}
 
-# Remove duplicates based on 'Strike ID'
-data = data.drop_duplicates(subset='Strike ID')
 
-# Sort data by 'Strike ID'
-data = data.sort_values(by='Strike ID')
+def load_results_from_store(db_path, strike_ids):
+    """Reads the results and offers of strike_ids into the report layout, with as many offer columns as the widest row.
+
+    Prices are read as the crawler wrote them, like in output.txt.
+    """
+    with sqlite3.connect(db_path) as connection:
+        connection.execute("CREATE TEMP TABLE report_ids (strike_id TEXT PRIMARY KEY)")
+        connection.executemany("INSERT OR IGNORE INTO report_ids VALUES (?)", [(strike_id,) for strike_id in strike_ids])
+        results = pd.read_sql_query(
+            """SELECT strike_id, sku, brand, mpn, model, upc, asin, COALESCE(my_price_text, CAST(my_price AS TEXT)), status FROM results
+               WHERE strike_id IN (SELECT strike_id FROM report_ids) ORDER BY strike_id""", connection)
+        offers = pd.read_sql_query(
+            """SELECT strike_id, offer_index, price_text AS price, condition, availability FROM offers
+               WHERE strike_id IN (SELECT strike_id FROM report_ids)""", connection)
+
+    results.columns = ['Strike ID', 'SKU', 'Brand', 'MPN', 'Model', 'UPC', 'Asin', 'My Price', 'Status']
+    if offers.empty:
+        return results
+
+    # One column per offer field, ordered Price 1, Condition 1, Availability 1, Price 2, ...
+    wide = offers.pivot(index='strike_id', columns='offer_index', values=['price', 'condition', 'availability'])
+    wide = wide.sort_index(axis=1, level=1, sort_remaining=False)
+    wide.columns = [f'{field.capitalize()} {offer_index}' for field, offer_index in wide.columns]
+    return results.join(wide, on='Strike ID')
+
+
+def to_price(column):
+    """Prices as floats, '$1,299.00' -> 1299.0, anything else NaN."""
+    if not pd.api.types.is_numeric_dtype(column):
+        # Text, or a mix of text and numbers like an offers pivot, is read as text
+        column = column.astype(str).str.replace(r'[$,\s]', '', regex=True)
+    return pd.to_numeric(column, errors='coerce')
+
+
+def add_price_analytics(data):
+    """Adds the competitor price columns after Status, computed on whole columns at once.
+
+    Delta is the lowest competitor price minus My Price, negative when a competitor is cheaper.
+    """
+    offer_indexes = sorted(int(name.split(' ')[1]) for name in data.columns
+                           if name.startswith('Price ') and name.split(' ')[1].isdigit())
+    # One row per input and one column per offer, an empty offer when the report has none
+    prices = np.column_stack([to_price(data[f'Price {i}']).to_numpy(dtype=float) for i in offer_indexes]
+                             or [np.full(len(data), np.nan)])
+    has_offer = ~np.isnan(prices)
+    offer_count = has_offer.sum(axis=1)
+    found = offer_count > 0
+
+    # The lowest price and its offer, rows without offers get NaN
+    cheapest = np.where(has_offer, prices, np.inf).argmin(axis=1)[:, None]
+    lowest_price = np.where(found, np.take_along_axis(prices, cheapest, axis=1)[:, 0], np.nan)
+    median_price = np.full(len(data), np.nan)
+    if found.any():
+        median_price[found] = np.nanmedian(prices[found], axis=1)
+
+    my_price = to_price(data['My Price']).to_numpy(dtype=float)
+    delta = lowest_price - my_price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_percent = np.where(my_price > 0, delta / my_price * 100, np.nan)
+
+    analytics = pd.DataFrame({
+        'Offer Count': offer_count,
+        'Lowest Price': lowest_price,
+        'Median Price': median_price,
+        'Price Delta': delta.round(2),
+        'Price Delta %': delta_percent.round(2),
+    }, index=data.index)
+    for field in ('Condition', 'Availability'):
+        values = np.column_stack([data[f'{field} {i}'].to_numpy(dtype=object) for i in offer_indexes]
+                                 or [np.full(len(data), None, dtype=object)])
+        analytics[f'Cheapest {field}'] = np.where(found, np.take_along_axis(values, cheapest, axis=1)[:, 0], None)
+
+    position = data.columns.get_loc('Status') + 1
+    return pd.concat([data.iloc[:, :position], analytics, data.iloc[:, position:]], axis=1)
+
+
+def read_output_file(path, chunk_size=None):
+    """Reads output.txt, whose rows have three columns per offer found, so as many columns as the widest row.
+
+    The C parser needs every column named up front, the width is found by counting tabs in one pass over the bytes.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf8').rstrip('\r\n').split('\t')
+        field_count = max((line.count(b'\t') + 1 for line in f), default=0)
+
+    # Name the offer columns past the header: Price 11, Condition 11, Availability 11, ...
+    names = list(header)
+    offer_index = (len(header) - 9) // 3
+    while len(names) < field_count:
+        offer_index += 1
+        names += [f'Price {offer_index}', f'Condition {offer_index}', f'Availability {offer_index}']
+
+    # The crawler writes fields as they are, quotes included. With a chunk size, an iterator of DataFrames
+    return pd.read_csv(path, sep='\t', dtype=str, header=None, skiprows=1, names=names,
+                       engine='c', quoting=csv.QUOTE_NONE, chunksize=chunk_size)
+
+
+def prepare_output_rows(data):
+    # Remove duplicate headers if they exist within the file data, a header line starts with 'Strike ID'
+    data = data.loc[data['Strike ID'].ne('Strike ID').to_numpy()]
+    return add_price_analytics(data)
+
+
+def read_output_chunks(path, chunk_size):
+    """Yields the report rows of output.txt one chunk at a time, in file order.
+
+    A Strike ID already seen in an earlier chunk is dropped, the first row of an input is kept like drop_duplicates.
+    """
+    seen_strike_ids = set()
+    for chunk in read_output_file(path, chunk_size):
+        chunk = prepare_output_rows(chunk)
+        chunk = chunk.drop_duplicates(subset='Strike ID')
+        chunk = chunk.loc[~chunk['Strike ID'].isin(seen_strike_ids).to_numpy()]
+        seen_strike_ids.update(chunk['Strike ID'])
+        yield chunk
+
+
+def write_report(frames, excel_filename):
+    """Writes the report in one pass with a write-only workbook, styling every cell with shared named styles.
+
+    frames are DataFrames with the same columns, written one after the other, so only one is in memory at a time.
+    One cell per column is reused for every row, append writes the row out before the next one is set.
+    """
+    frames = iter(frames)
+    data = next(frames)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Report')
+
+    # Apply font, border, and header fill formatting
+    font = Font(name='Cambria', size=10)
+    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    header_fill = PatternFill(start_color='00B050', end_color='00B050', fill_type='solid')  # RGB color: 0, 176, 80
+    alignment = Alignment(horizontal='left')  # Align all cells to the left
+    wb.add_named_style(NamedStyle(name='Report Cell', font=font, border=border, alignment=alignment))
+    wb.add_named_style(NamedStyle(name='Report Header', font=font, border=border, alignment=alignment, fill=header_fill))
+
+    # Set column widths to 13.5
+    column_width = 13.5
+    for column_index in range(1, len(data.columns) + 1):
+        ws.column_dimensions[get_column_letter(column_index)].width = column_width
+
+    # Set tab color to RGB 0, 176, 80
+    ws.sheet_properties.tabColor = "00B050"  # Hex color code for RGB 0, 176, 80
+
+    # Apply header formatting
+    header = []
+    for name in data.columns:
+        cell = WriteOnlyCell(ws, value=str(name))
+        cell.style = 'Report Header'
+        header.append(cell)
+    ws.append(header)
+
+    cells = []
+    for _ in data.columns:
+        cell = WriteOnlyCell(ws)
+        cell.style = 'Report Cell'
+        cells.append(cell)
+    for data in chain([data], frames):
+        # Missing values become empty cells, they keep the border
+        values = data.astype(object).where(data.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            for cell, value in zip(cells, row):
+                cell.value = value
+            ws.append(cells)
+
+    # Save the workbook
+    wb.save(excel_filename)
+
+
+if os.path.exists(result_db):
+    frames = [add_price_analytics(load_results_from_store(result_db, read_input_strike_ids(input_file_path)))]
+elif chunk_size:
+    # Only one chunk is in memory at a time, the rows stay in file order instead of sorted by Strike ID
+    frames = read_output_chunks(file_path, chunk_size)
+else:
+    # Read the data with a single header
+    data = prepare_output_rows(read_output_file(file_path))
+
+    # Remove duplicates based on 'Strike ID'
+    data = data.drop_duplicates(subset='Strike ID')
+
+    # Sort data by 'Strike ID'
+    frames = [data.sort_values(by='Strike ID')]
+
 
 # Define the file name with current date
 current_date = datetime.now().strftime("%m.%d.%Y")
 excel_filename = f'ReportfromStrikeaprice_Techforless_Serversupply.com_{current_date}.xlsx'
 
 # Save to Excel
-data.to_excel(excel_filename, sheet_name='Report', index=False)
-
-# Load the workbook and sheet
-wb = load_workbook(excel_filename)
-ws = wb['Report']
-
-# Apply font, border, and header fill formatting
-font = Font(name='Cambria', size=10)
-border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-header_fill = PatternFill(start_color='00B050', end_color='00B050', fill_type='solid')  # RGB color: 0, 176, 80
-
-# Apply font, border, and alignment formatting
-for row in ws.iter_rows():
-    for cell in row:
-        cell.font = font
-        cell.border = border
-        cell.alignment = Alignment(horizontal='left')  # Align all cells to the left
-
-# Apply header formatting
-for cell in ws[1]:
-    cell.fill = header_fill
-
-# Set column widths to 13.5
-column_width = 13.5
-for col in ws.columns:
-    column_letter = col[0].column_letter
-    ws.column_dimensions[column_letter].width = column_width
-
-# Set tab color to RGB 0, 176, 80
-ws.sheet_properties.tabColor = "00B050"  # Hex color code for RGB 0, 176, 80
-
-# Save the workbook
-wb.save(excel_filename)
+write_report(frames, excel_filename)
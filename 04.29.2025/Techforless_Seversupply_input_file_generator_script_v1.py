@@ -1,13 +1,254 @@
+import os
+import re
+import codecs
+import sqlite3
+import hashlib
+import numpy as np
 import pandas as pd
 from datetime import datetime
-import chardet
+from itertools import chain
+from chardet.universaldetector import UniversalDetector
+
+# Rows read at a time by the streaming mode, memory stays flat whatever the size of the catalog
+CHUNK_SIZE = 100000
+
+# SKU -> Strike ID of every catalog row seen so far, so a row keeps its id when rows are added or removed.
+# A repeated SKU is kept apart by its occurrence number (SKU#2, SKU#3...). A strike_id_map.txt from
+# before the map was kept in sqlite is imported on the first run.
+STRIKE_ID_MAP_FILE = 'strike_id_map.db'
+# Strike ID -> hash of the row in the previous catalog, used by changed_only to write only the new or changed rows
+CATALOG_STATE_FILE = 'catalog_state.db'
+# The crawler's identification files, with the output and error files they go with (identification.txt,
+# identification_2.txt of a shard, serversupply_identification.txt of the multi-site crawler...).
+# A changed_only input moves them aside so the crawl starts over, the ids of changed rows are in them already.
+CRAWLER_RUN_FILE = re.compile(r'^(?:\w+_)?(?:identification|output|error)(?:_\d+)?\.txt$')
+
 
 def detect_encoding(file_path):
     with open(file_path, 'rb') as file:
-        result = chardet.detect(file.read())
-    return result['encoding']
+        encoding, last_block = feed_detector(file)
+
+        # A UTF-8 verdict can come before a stray single byte character further down the file,
+        # so the rest, from the block the detector stopped on, has to decode before it is trusted
+        if encoding is not None and encoding.lower() in ('utf-8', 'utf-8-sig', 'ascii'):
+            invalid_block = find_invalid_utf8_block(last_block, file)
+            if invalid_block is not None:
+                # Detect again, starting with the block that rules UTF-8 out
+                file.seek(0)
+                encoding, last_block = feed_detector(file, invalid_block)
+    return encoding
+
+
+def feed_detector(file, first_block=b''):
+    """Feeds the file to the detector in blocks until it is confident, returns (encoding, last block fed)."""
+    detector = UniversalDetector()
+    block = first_block
+    detector.feed(block)
+    if not detector.done:
+        for block in iter(lambda: file.read(64 * 1024), b''):
+            detector.feed(block)
+            if detector.done:
+                break
+    detector.close()
+    return detector.result['encoding'], block
+
+
+def find_invalid_utf8_block(first_block, file):
+    """Returns the first block, from first_block on, that does not decode as UTF-8, None if they all do."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    # Continuation bytes of a character split with the block before first_block
+    block = first_block.lstrip(bytes(range(0x80, 0xC0)))
+    try:
+        decoder.decode(block)
+        for block in iter(lambda: file.read(64 * 1024), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return block
+    return None
+
+
+def combine_dtypes(dtype, other):
+    # The way pandas joins the dtypes of the blocks it parses: numbers become float64, anything else text
+    if dtype == other:
+        return dtype
+    if dtype.kind in 'iuf' and other.kind in 'iuf':
+        return np.dtype('float64')
+    return np.dtype(object)
+
+
+def read_column_dtypes(csv_file_path, encoding, chunk_size):
+    """The dtype of every column of the whole file, as generate_report gets it, settled one chunk at a time."""
+    dtypes = {}
+    for chunk in pd.read_csv(csv_file_path, encoding=encoding, delimiter='\t', chunksize=chunk_size):
+        for name, dtype in chunk.dtypes.items():
+            dtypes[name] = combine_dtypes(dtypes[name], dtype) if name in dtypes else dtype
+    # Text columns are read as they are
+    return {name: str if dtype == object else dtype for name, dtype in dtypes.items()}
+
+
+def format_rows(df):
+    """Every row as a tab separated line: every cell as str(), NaN as an empty string.
+
+    Cells are converted a whole column at a time and the lines joined in one pass.
+    """
+    if df.empty:
+        return []
+    columns = []
+    for name in df.columns:
+        column = df[name]
+        if column.dtype.kind == 'f':
+            # numpy writes floats the same way as str() does
+            values = column.to_numpy().astype(str)
+        else:
+            values = column.astype(str).to_numpy(dtype=object)
+        missing = column.isna().to_numpy()
+        if missing.any():
+            values = np.where(missing, '', values)
+        columns.append(values.tolist())
+    return list(map('\t'.join, zip(*columns)))
+
+
+def write_rows(file, strike_ids, lines, keep=None):
+    # Write rows without header, only the kept ones when keep is given
+    rows = [f'{strike_id}\t{line}' for strike_id, line in zip(strike_ids, lines)]
+    if keep is not None:
+        rows = [row for row, kept in zip(rows, keep) if kept]
+    if rows:
+        file.write('\n'.join(rows))
+        file.write('\n')
+    return len(rows)
+
+
+def open_lookup_db(file_path):
+    connection = sqlite3.connect(file_path)
+    # The keys of the chunk being looked up, joined to the tables so only that chunk is read into memory
+    connection.execute("CREATE TEMP TABLE lookup_keys (key TEXT PRIMARY KEY)")
+    return connection
+
+
+def fetch_by_keys(connection, query, keys):
+    """Runs query, joined to temp.lookup_keys, for the given keys and returns its rows as a dict."""
+    connection.execute("DELETE FROM temp.lookup_keys")
+    connection.executemany("INSERT OR IGNORE INTO temp.lookup_keys VALUES (?)", ((key,) for key in keys))
+    return dict(connection.execute(query))
+
+
+class StrikeIdAssigner:
+    """Gives every catalog row its Strike ID from the SKU map; SKUs not seen before get the next free number.
+
+    The map is a sqlite table looked up a chunk at a time, new SKUs are kept only once save() commits them.
+    """
+
+    def __init__(self, map_file_path, prefix):
+        self.map_file_path = map_file_path
+        self.prefix = prefix
+        self.added = 0
+        self.connection = open_lookup_db(map_file_path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS strike_ids (key TEXT PRIMARY KEY, strike_id TEXT NOT NULL)")
+        # Occurrences of each SKU in this catalog so far
+        self.connection.execute("CREATE TEMP TABLE seen (sku TEXT PRIMARY KEY, occurrences INTEGER NOT NULL)")
+        self.import_text_map(f'{os.path.splitext(map_file_path)[0]}.txt')
+        last_number = 0
+        for (strike_id,) in self.connection.execute("SELECT strike_id FROM strike_ids"):
+            number = strike_id[len(prefix):]
+            if strike_id.startswith(prefix) and number.isdigit():
+                last_number = max(last_number, int(number))
+        self.next_number = last_number + 1
+
+    def import_text_map(self, text_file_path):
+        if not os.path.exists(text_file_path) or self.connection.execute("SELECT 1 FROM strike_ids LIMIT 1").fetchone():
+            return
+        with open(text_file_path, 'r', encoding='utf8') as file:
+            entries = (line.rstrip('\n').split('\t') for line in file)
+            self.connection.executemany("INSERT OR REPLACE INTO strike_ids VALUES (?, ?)", (splits for splits in entries if len(splits) == 2))
+        self.connection.commit()
+        print(f'Imported {text_file_path} into {self.map_file_path}')
+
+    def assign(self, skus):
+        skus = skus.fillna('').astype(str).tolist()
+        seen = fetch_by_keys(self.connection, "SELECT sku, occurrences FROM temp.seen JOIN temp.lookup_keys ON sku = key", skus)
+        keys = []
+        for sku in skus:
+            occurrence = seen.get(sku, 0) + 1
+            seen[sku] = occurrence
+            keys.append(sku if occurrence == 1 else f'{sku}#{occurrence}')
+        self.connection.executemany("INSERT OR REPLACE INTO temp.seen VALUES (?, ?)", seen.items())
+
+        ids = fetch_by_keys(self.connection, "SELECT strike_ids.key, strike_id FROM strike_ids JOIN temp.lookup_keys USING (key)", keys)
+        strike_ids = []
+        new_entries = []
+        for key in keys:
+            strike_id = ids.get(key)
+            if strike_id is None:
+                strike_id = f'{self.prefix}{str(self.next_number).zfill(6)}'
+                self.next_number += 1
+                new_entries.append((key, strike_id))
+            strike_ids.append(strike_id)
+        self.connection.executemany("INSERT INTO strike_ids VALUES (?, ?)", new_entries)
+        self.added += len(new_entries)
+        return strike_ids
+
+    def save(self):
+        self.connection.commit()
+        print(f'Added {self.added} new SKUs to {self.map_file_path}')
+        self.added = 0
+
+    def close(self):
+        self.connection.close()
+
+
+class CatalogState:
+    """Row hashes of the previous catalog by Strike ID, to tell the new and changed rows apart.
 
-def generate_report(csv_file_path, output_file_path):
+    Kept in sqlite and looked up a chunk at a time like the SKU map.
+    """
+
+    def __init__(self, state_file_path):
+        self.connection = open_lookup_db(state_file_path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS row_hashes (strike_id TEXT PRIMARY KEY, row_hash TEXT NOT NULL)")
+        self.connection.execute("CREATE TEMP TABLE current_hashes (strike_id TEXT PRIMARY KEY, row_hash TEXT NOT NULL)")
+
+    def changed(self, strike_ids, lines):
+        """Records the rows and returns, for each one, whether it is new or differs from the previous catalog."""
+        row_hashes = [hashlib.blake2b(line.encode('utf8', errors='replace'), digest_size=8).hexdigest() for line in lines]
+        previous = fetch_by_keys(self.connection, "SELECT strike_id, row_hash FROM row_hashes JOIN temp.lookup_keys ON strike_id = key", strike_ids)
+        self.connection.executemany("INSERT OR REPLACE INTO temp.current_hashes VALUES (?, ?)", zip(strike_ids, row_hashes))
+        return [previous.get(strike_id) != row_hash for strike_id, row_hash in zip(strike_ids, row_hashes)]
+
+    def save(self):
+        # Rows no longer in the catalog are dropped
+        self.connection.execute("DELETE FROM row_hashes")
+        self.connection.execute("INSERT INTO row_hashes SELECT strike_id, row_hash FROM temp.current_hashes")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def move_crawler_run_files():
+    # The crawl of a changed_only input starts over, the files are kept with the time they were moved at
+    moved_at = datetime.now().strftime('%Y%m%d_%H%M%S')
+    for file_name in sorted(os.listdir('.')):
+        if CRAWLER_RUN_FILE.match(file_name):
+            os.replace(file_name, f'{file_name}.{moved_at}')
+            print(f'Moved {file_name} to {file_name}.{moved_at}, the crawl of the changed rows starts over')
+
+
+def get_strike_ids(assigner, skus, strike_id_prefix, row_count):
+    if assigner is not None:
+        return assigner.assign(skus)
+    # Positional ids, row 1 is TESS000001
+    return [f'{strike_id_prefix}{str(row_count + i + 1).zfill(6)}' for i in range(len(skus))]
+
+
+def generate_report(csv_file_path, output_file_path, stable_ids=True, changed_only=False):
+    """Writes the crawler input file.
+
+    stable_ids keeps each SKU's Strike ID from STRIKE_ID_MAP_FILE. changed_only writes only the rows
+    that are new or changed since the last changed_only run, whose catalog is kept in CATALOG_STATE_FILE,
+    and moves the crawler's identification, output and error files aside (see CRAWLER_RUN_FILE).
+    """
     print('Starting to generate the input file')
     
     # Define the 'Strike ID' prefix and initialize counter
@@ -29,33 +270,105 @@ def generate_report(csv_file_path, output_file_path):
         print(status_messages[-1])  # Print to console
         return
 
-    # Add 'Strike ID' column
-    strike_ids = [f'{strike_id_prefix}{str(i + 1).zfill(6)}' for i in range(len(df))]
-    df.insert(0, 'Strike id', strike_ids)  # Insert 'Strike id' as the first column
-
     # Ensure all columns have appropriate names
-    df.columns = expected_columns
+    df.columns = expected_columns[1:]
+
+    # 'Strike ID' goes first on every line
+    assigner = StrikeIdAssigner(STRIKE_ID_MAP_FILE, strike_id_prefix) if stable_ids else None
+    strike_ids = get_strike_ids(assigner, df['SKU'], strike_id_prefix, 0)
+    lines = format_rows(df)
+    catalog_state = CatalogState(CATALOG_STATE_FILE) if changed_only else None
+    changed = catalog_state.changed(strike_ids, lines) if catalog_state is not None else None
 
     # Write to a text file
     output_file_name = f"{output_file_path}.txt"
     
     try:
         with open(output_file_name, 'w') as file:
-            
-            # Write rows without header
-            for row in df.itertuples(index=False, name=None):
-                row_str = '\t'.join(map(lambda x: '' if pd.isna(x) else str(x), row))
-                file.write(f'{row_str}\n')
-            
+            written = write_rows(file, strike_ids, lines, changed)
             file.write('\n')
-            
-        print(f'Created the input file: {output_file_name}')
+
+        if assigner is not None:
+            assigner.save()
+        if catalog_state is not None:
+            catalog_state.save()
+            move_crawler_run_files()
+        print(f'Created the input file: {output_file_name} with {written} of {len(lines)} rows')
+    except PermissionError as e:
+        print(f'Permission error: {e}. Please ensure the file is not open or try running the script with different permissions.')
+    except Exception as e:
+        print(f'An unexpected error occurred: {e}. Exiting.')
+    finally:
+        if assigner is not None:
+            assigner.close()
+        if catalog_state is not None:
+            catalog_state.close()
+
+def generate_report_streaming(csv_file_path, output_file_path, chunk_size=CHUNK_SIZE, stable_ids=True, changed_only=False):
+    """Same input file as generate_report, read and written CHUNK_SIZE rows at a time.
+
+    A first pass over the file settles the dtype pandas gives each column when it reads the whole file,
+    so numbers are written the same way (a UPC as 757120003946.0) and both modes share the Strike ID map
+    and the catalog state.
+    """
+    print('Starting to generate the input file in streaming mode')
+
+    strike_id_prefix = 'TESS'
+    expected_columns = ['Strike id', 'SKU', 'Model Number', 'Title', 'Product URL', 'Image URL', 'UPC', 'Manufacturer', 'MPN', 'Category', 'ASIN', 'Price', 'Shipping', 'weight', 'dimensions', 'Lip']
+
+    encoding = detect_encoding(csv_file_path)
+    dtypes = read_column_dtypes(csv_file_path, encoding, chunk_size)
+    reader = pd.read_csv(csv_file_path, encoding=encoding, delimiter='\t', dtype=dtypes, chunksize=chunk_size)
+    first_chunk = next(reader, None)
+    if first_chunk is None or first_chunk.shape[1] != len(expected_columns) - 1:
+        found_columns = 0 if first_chunk is None else first_chunk.shape[1] + 1
+        print(f'Column mismatch: Expected {len(expected_columns)} columns, but found {found_columns}.')
+        return
+
+    assigner = StrikeIdAssigner(STRIKE_ID_MAP_FILE, strike_id_prefix) if stable_ids else None
+    catalog_state = CatalogState(CATALOG_STATE_FILE) if changed_only else None
+    output_file_name = f"{output_file_path}.txt"
+    row_count = written = 0
+    try:
+        with open(output_file_name, 'w') as file:
+            for chunk in chain([first_chunk], reader):
+                chunk.columns = expected_columns[1:]
+                # The Strike ID counter and the SKU map carry on from the previous chunk
+                strike_ids = get_strike_ids(assigner, chunk['SKU'], strike_id_prefix, row_count)
+                lines = format_rows(chunk)
+                changed = catalog_state.changed(strike_ids, lines) if catalog_state is not None else None
+                written += write_rows(file, strike_ids, lines, changed)
+                row_count += len(chunk)
+                print(f'Read {row_count} rows, written {written}')
+
+            file.write('\n')
+
+        if assigner is not None:
+            assigner.save()
+        if catalog_state is not None:
+            catalog_state.save()
+            move_crawler_run_files()
+        print(f'Created the input file: {output_file_name} with {written} of {row_count} rows')
     except PermissionError as e:
         print(f'Permission error: {e}. Please ensure the file is not open or try running the script with different permissions.')
     except Exception as e:
         print(f'An unexpected error occurred: {e}. Exiting.')
+    finally:
+        if assigner is not None:
+            assigner.close()
+        if catalog_state is not None:
+            catalog_state.close()
 
 # Usage
 csv_file_path = 'sap_enterprise.csv'  # Replace with the path to your CSV file
 output_file_path = 'input'  # Base name for the output text file
-generate_report(csv_file_path, output_file_path)
+# Set to True for catalogs too large to load at once, it writes the same file as the default mode
+streaming = False
+stable_ids = True  # Keep each SKU's Strike ID across runs instead of numbering rows by position
+# Set to True to write only the rows that are new or changed since the last changed_only run. The crawler's
+# identification, output and error files are moved aside, so the crawl of the changed rows starts over.
+changed_only = False
+if streaming:
+    generate_report_streaming(csv_file_path, output_file_path, stable_ids=stable_ids, changed_only=changed_only)
+else:
+    generate_report(csv_file_path, output_file_path, stable_ids=stable_ids, changed_only=changed_only)
@@ -2,14 +2,34 @@ import os
 import logging
 import time
 import re
-
+import heapq
+import random
+import itertools
+import json
+import locale
+import zlib
+import sqlite3
+import queue
+import asyncio
+import statistics
+import threading
+import requests
+from abc import ABC, abstractmethod
+
+from bs4 import BeautifulSoup
 from datetime import datetime
+from urllib.parse import urljoin, urlparse
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import (TimeoutException, WebDriverException, InvalidSessionIdException,
+                                        SessionNotCreatedException, NoSuchWindowException)
+from urllib3.exceptions import MaxRetryError, ProtocolError
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 
 # Get environment variables
@@ -25,43 +45,240 @@ caps = DesiredCapabilities.CHROME
 caps = DesiredCapabilities().CHROME
 caps["pageLoadStrategy"] = "none"  # Do not wait for the full page load
 
+# Lean browser: images, fonts, media and third-party trackers are blocked through the DevTools protocol.
+# Stylesheets are left on by default because Selenium's .text only returns visible text.
+# Domains in ALLOWED_DOMAINS are never blocked as third-party.
+LEAN_BROWSER = True
+LEAN_BROWSER_STATS = True
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+]
+BLOCKED_THIRD_PARTY_DOMAINS = [
+    "google-analytics.com", "googletagmanager.com", "googleadservices.com", "doubleclick.net",
+    "googlesyndication.com", "facebook.net", "facebook.com", "bing.com", "clarity.ms",
+    "hotjar.com", "criteo.com", "adroll.com", "linkedin.com", "twitter.com",
+    "trustpilot.com", "zopim.com", "livechatinc.com", "fonts.googleapis.com", "fonts.gstatic.com",
+]
+ALLOWED_DOMAINS = []
+
+if LEAN_BROWSER_STATS:
+    # Network events are read back from the performance log to report the traffic of every page
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+
 IDENTIFICATION_FILE = "identification.txt"
 INPUT_FILE = "input.txt"
 OUTPUT_FILE = "output.txt"
 ERROR_FILE = "error.txt"
+# Live counters of the run, rewritten at most every STATS_SAVE_SECONDS while crawling
+STATS_FILE = "run_stats.json"
+STATS_SAVE_SECONDS = 5
+# The input generator writes with the platform's default encoding
+INPUT_ENCODING = locale.getpreferredencoding(False)
+
+# Several processes can share one input file, each one reading its own byte range of it.
+# Set the environment variables crawler_shard_count and crawler_shard_index (0 based) for every process;
+# each shard keeps its own identification, output and error files, the caches and result store are shared.
+INPUT_SHARD_COUNT = int(os.getenv('crawler_shard_count', '1'))
+INPUT_SHARD_INDEX = int(os.getenv('crawler_shard_index', '0'))
+if INPUT_SHARD_COUNT > 1:
+    IDENTIFICATION_FILE = f"identification_{INPUT_SHARD_INDEX + 1}.txt"
+    STATS_FILE = f"run_stats_{INPUT_SHARD_INDEX + 1}.json"
+    OUTPUT_FILE = f"output_{INPUT_SHARD_INDEX + 1}.txt"
+    ERROR_FILE = f"error_{INPUT_SHARD_INDEX + 1}.txt"
+
+# Output, identification and error lines are buffered and committed together once WRITER_BATCH_SIZE
+# rows are waiting or WRITER_FLUSH_SECONDS have passed. Output rows are always written before their ids,
+# so after a crash the rows without an id (at most one batch) are dropped from the end of the output.
+# WRITER_FSYNC survives a power loss at the cost of speed.
+WRITER_BATCH_SIZE = 50
+WRITER_FLUSH_SECONDS = 5
+WRITER_FSYNC = False
+
+# Typed copy of the results in sqlite, one row per input and one per (Strike ID, offer), upserted on rerun
+USE_RESULT_STORE = True
+RESULT_DB = "results.db"
 
 SEARCH_URL = "https://www.serversupply.com/products/part_search/query_parts.asp?q="
 TIMEOUT_SECONDS = 30
 
-web_driver = None
+# Browser pages are polled until they reach a terminal state (results, not found, details).
+# Once READINESS_MIN_SAMPLES loads are seen for a page type, its timeout follows the observed
+# p95 load time times READINESS_TIMEOUT_FACTOR, kept between READINESS_MIN_TIMEOUT and TIMEOUT_SECONDS.
+READINESS_POLL_SECONDS = 0.1
+READINESS_MIN_SAMPLES = 20
+READINESS_SAMPLE_SIZE = 200
+READINESS_TIMEOUT_FACTOR = 3
+READINESS_MIN_TIMEOUT = 5
+
+# Set on the old document before navigating, so a state is never read off the previous page
+MARK_STALE_PAGE_SCRIPT = "window.__crawlerStalePage = true;"
+
+SEARCH_PAGE_STATE_SCRIPT = """
+if (window.__crawlerStalePage) return null;
+if (document.title.toLowerCase() == 'not found') return 'not_found';
+if (document.querySelector('section.section-content.bg.padding-y')) return 'results';
+return null;
+"""
+
+# Link and card text of every search result, in one round trip
+SEARCH_RESULTS_SCRIPT = """
+var section = document.querySelector('section.section-content.bg.padding-y');
+var results = [];
+if (section && section.querySelector('article.card.card-product')) {
+    results = document.querySelectorAll('section.section-content.bg.padding-y div.card-body div.img-wrap');
+} else if (section && section.querySelector('div.productbox')) {
+    results = document.querySelectorAll('section.section-content.bg.padding-y div.productbox div.imgBox');
+}
+return Array.from(results).map(function (result) {
+    var link = result.querySelector('a');
+    var card = result.closest('article, div.productbox') || result;
+    return [link ? link.href : null, card.innerText];
+});
+"""
+
+# The price is often rendered by javascript after the document is complete, so a page with its part
+# number but no price yet is read once it has been complete for DETAILS_PAGE_SETTLE_SECONDS.
+# A page that still has no price then is a page without one, get_product_from_page skips it.
+DETAILS_PAGE_SETTLE_SECONDS = 1
+DETAILS_PAGE_STATE_SCRIPT = """
+if (window.__crawlerStalePage) return null;
+if (document.title.toLowerCase() == 'not found') return 'not_found';
+if (!document.querySelector('span.skumodel')) return null;
+var price = document.querySelector('span.pricebig.protected');
+if (price && price.textContent.trim() != '') return 'details';
+if (document.readyState != 'complete') return null;
+window.__crawlerCompleteAt = window.__crawlerCompleteAt || Date.now();
+return Date.now() - window.__crawlerCompleteAt >= %d ? 'details' : null;
+""" % (DETAILS_PAGE_SETTLE_SECONDS * 1000)
+
+# Details page fields read by one script call instead of a driver call per element
+SCRIPT_EXTRACTION = True
+DETAILS_PAGE_FIELDS_SCRIPT = """
+var skuTexts = Array.from(document.querySelectorAll('span.skumodel')).map(function (el) { return el.innerText.trim(); });
+var specs = document.querySelectorAll('div.card-body.detail_overviewd > li');
+if (!specs.length) specs = document.querySelectorAll('div.card-body.detail_overviewd > p');
+var price = document.querySelector('span.pricebig.protected');
+return {
+    sku_texts: skuTexts,
+    price: price ? price.innerText.trim() : null,
+    specs: Array.from(specs).map(function (el) { return el.innerText.trim(); })
+};
+"""
+
+# HTTP-first fetching: pages are requested over a pooled session and parsed from the static HTML.
+# Selenium is only used when a page does not parse (e.g. content rendered by javascript).
+USE_HTTP_FETCH = True
+HTTP_TIMEOUT_SECONDS = 15
+HTTP_POOL_SIZE = 10
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# Persistent page cache for the HTTP fetches, keyed by url. Entries younger than their page type TTL
+# are used as-is, older ones are revalidated with ETag / Last-Modified when the server sent them.
+USE_PAGE_CACHE = True
+CACHE_FILE = "page_cache.db"
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+CACHE_TTL_SECONDS = {
+    "search": 12 * 60 * 60,
+    "details": 24 * 60 * 60,
+}
+# Cache hits update the last access time used for eviction in batches of CACHE_ACCESS_BATCH_SIZE
+CACHE_ACCESS_BATCH_SIZE = 500
+
+# Learned index of normalized SKU -> product urls confirmed by an earlier run. Indexed rows go straight
+# to their detail pages; rows that are new, missing from the index, stale or no longer match are searched.
+USE_URL_INDEX = True
+URL_INDEX_FILE = "url_index.txt"
+URL_INDEX_MAX_AGE_DAYS = 7
+
+# Within a run, inputs with the same normalized MPN share one search and every detail url is
+# fetched and parsed once; each input still matches the shared page against its own SKU.
+USE_SINGLE_FLIGHT = True
+
+# Run mode: "serial" handles one input at a time, "async" keeps CONCURRENT_REQUESTS inputs in flight,
+# "workers" runs WORKER_COUNT threads pulling inputs from a shared queue.
+# With ORDERED_OUTPUT the rows are written in input order, so output.txt matches the serial run.
+RUN_MODE = "async"
+CONCURRENT_REQUESTS = 8
+MAX_REQUESTS_PER_HOST = 4
+ORDERED_OUTPUT = True
+WORKER_COUNT = 4
+
+# Inputs failing on a transient error (page timeout, browser or connection failure) are not reported as
+# NOT FOUND; they are retried after the main pass, at most RETRY_BUDGET times each, waiting
+# RETRY_BASE_SECONDS * 2^(attempt - 1) (at most RETRY_MAX_SECONDS) before each attempt. Inputs still failing,
+# and inputs failing on any other error, go to the error file.
+RETRY_BUDGET = 3
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 600
+
+# Adaptive per-host limits (AIMD). A host starts at AIMD_INITIAL_LIMIT requests in flight. Every fast,
+# successful response adds 1/limit (about one more per round of requests), up to MAX_REQUESTS_PER_HOST,
+# and shortens the gap between request starts by AIMD_INTERVAL_STEP_SECONDS. A 429/5xx, a timeout,
+# a response slower than AIMD_SLOW_FACTOR times the host's usual latency for that kind of fetch (HTTP
+# or browser) or a soft block (a live search page titled "Not Found") multiplies the limit by AIMD_DECREASE_FACTOR and widens the gap, at most
+# once per AIMD_DECREASE_COOLDOWN_SECONDS so a burst of failures counts once.
+# Without it every host is held at MAX_REQUESTS_PER_HOST.
+USE_ADAPTIVE_HOST_LIMITS = True
+AIMD_INITIAL_LIMIT = 2
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_SLOW_FACTOR = 3
+AIMD_INTERVAL_STEP_SECONDS = 0.05
+AIMD_MAX_INTERVAL_SECONDS = 5
+AIMD_DECREASE_COOLDOWN_SECONDS = 2
+
+# Search results whose card text does not mention the SKU are not opened. Cards without text are
+# always opened, and so is the whole listing when no card shows a part number at all (a layout
+# whose cards only have titles), since the cards then say nothing about the part.
+FILTER_SEARCH_CANDIDATES = True
+
+# Detail pages of one search result fetched in parallel, results are kept in listing order
+DETAIL_PAGE_CONCURRENCY = 4
+
+# Number of Chrome sessions kept for the pages that need a browser, each one loads a page at a time
+WEB_DRIVER_POOL_SIZE = 4
+
+web_driver_pool = None
+http_session = None
+page_cache = None
+url_index = None
+site_state = None
+host_limiters = {}
+host_limiters_lock = threading.Lock()
 
 class Request:
+    # Only the fields the crawler uses are kept, the full line stays in input_string for the error file
+    __slots__ = ('strike_id', 'sku', 'model', 'upc', 'brand', 'mpn', 'asin', 'price', 'input_string',
+                 'normalized_sku', 'normalized_mpn')
 
     def __init__(self, req_string:str):
         if req_string is not None and req_string.strip() != "":    
             # Strike ID	SKU	Brand	MPN	Model	UPC	Asin    MyPrice
             # Strike ID	SKU	Model Number	Title	Product URL	Image URL	UPC	Manufacturer	MPN	Category	ASIN	Price	Shipping	weight	dimensions	Lip
 
-            req_splits = req_string.strip().split('\t')
+            self.input_string = req_string.strip()
+            # Nothing after the Price column is used, so the rest of the line is left unsplit
+            req_splits = self.input_string.split('\t', 12)
             self.strike_id = req_splits[0]
             self.sku = req_splits[1]
             self.model = req_splits[2]
-            self.title = req_splits[3]
-            self.product_url = req_splits[4]
-            self.image_url = req_splits[5]
             self.upc = req_splits[6]
             self.brand = req_splits[7]
             self.mpn = req_splits[8]
-            self.category = req_splits[9]
             self.asin = req_splits[10]
             self.price = req_splits[11]
-            self.shipping = req_splits[12]
-            self.weight = req_splits[13]
-            self.dimesion = req_splits[14]
-            self.lip = req_splits[15]
-            self.input_string = req_string.strip()
+            # Compared against every page the input opens, so normalized once
+            self.normalized_sku = normalize_part_number(self.sku)
+            self.normalized_mpn = normalize_part_number(self.mpn)
 
 class Product:
+    __slots__ = ('price', 'condition', 'availability')
+
     def __init__(self, price:str="na", condition:str="na", availability:str="na") -> None:
         self.price = price
         self.condition = condition
@@ -77,19 +294,72 @@ def log_and_console_error(message: str):
     logging.error(f'ERROR : {message}')
 
 
+class RunCounters:
+    """In-memory counts of the run, saved to the stats file as they change."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.started_at = str(datetime.now())
+        self.last_saved = 0
+        self.counts = {'inputs': 0, 'found': 0, 'not_found': 0, 'errors': 0, 'skipped': 0, 'retries': 0, 'detail_pages_avoided': 0}
+
+    def add(self, name: str, count: int = 1):
+        with self.lock:
+            self.counts[name] += count
+            if time.monotonic() - self.last_saved >= STATS_SAVE_SECONDS:
+                self.save_locked()
+
+    def set(self, name: str, count: int):
+        with self.lock:
+            self.counts[name] = count
+
+    def save(self):
+        with self.lock:
+            self.save_locked()
+
+    def save_locked(self):
+        stats = dict(self.counts, hosts=get_host_limit_metrics(), started_at=self.started_at, updated_at=str(datetime.now()))
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w', encoding='utf8') as stats_file:
+            json.dump(stats, stats_file, indent=2)
+        os.replace(temp_filename, self.filename)
+        self.last_saved = time.monotonic()
+
+    def log(self):
+        with self.lock:
+            counts = dict(self.counts)
+        log_and_console_info("\n")
+        log_and_console_info("########################################")
+        log_and_console_info(f"##### Inputs this run is     : {counts['inputs']}")
+        log_and_console_info(f"##### Skipped on resume is   : {counts['skipped']}")
+        log_and_console_info(f"##### Found is               : {counts['found']}")
+        log_and_console_info(f"##### Not found is           : {counts['not_found']}")
+        log_and_console_info(f"##### Errors is              : {counts['errors']}")
+        log_and_console_info(f"##### Retries is             : {counts['retries']}")
+        log_and_console_info(f"##### Detail pages avoided   : {counts['detail_pages_avoided']}")
+        log_and_console_info("########################################")
+
+
+run_counters = RunCounters(STATS_FILE)
+
+
+def initiate_run_counters():
+    global run_counters
+    run_counters = RunCounters(STATS_FILE)
+
+
 def print_data_count():
+    # Recount of the files on disk, one buffered line at a time and without the blank lines
     input_count = output_count = error_count = 0
-    with open(INPUT_FILE, 'r', encoding='utf8', errors='replace') as input_file:
-        input_count = len(input_file.readlines())
+    input_count = count_input_lines(INPUT_FILE)
 
     if(os.path.exists(OUTPUT_FILE)):
-        with open(OUTPUT_FILE, 'r', encoding='utf8', errors='replace') as output_file:
-            output_count = len(output_file.readlines())
-            output_count = output_count - 1  # Excluding the titles
+        output_count = count_input_lines(OUTPUT_FILE)
+        output_count = output_count - 1  # Excluding the titles
 
     if(os.path.exists(ERROR_FILE)):
-        with open(ERROR_FILE, 'r', encoding='utf8', errors='replace') as error_file:
-            error_count = len(error_file.readlines())
+        error_count = count_input_lines(ERROR_FILE)
 
     log_and_console_info("\n")
     log_and_console_info("########################################")
@@ -99,32 +369,529 @@ def print_data_count():
     log_and_console_info("########################################")
 
 
-def initiate_web_driver():
-    global web_driver
-
-    quit_web_driver()
-
+def create_web_driver():
     log_and_console_info("Getting Web Driver started!")
     web_driver = webdriver.Chrome(desired_capabilities=caps, service=service, options=options)
     web_driver.maximize_window()
     # web_driver.implicitly_wait(10)
+    if LEAN_BROWSER:
+        web_driver.execute_cdp_cmd('Network.enable', {})
+        web_driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': get_blocked_url_patterns()})
+    return web_driver
+
+
+def get_blocked_url_patterns():
+    patterns = list(BLOCKED_URL_PATTERNS)
+    for domain in BLOCKED_THIRD_PARTY_DOMAINS:
+        if domain in ALLOWED_DOMAINS:
+            continue
+        patterns.append(f"*://{domain}/*")
+        patterns.append(f"*://*.{domain}/*")
+    return patterns
+
+
+class BrowserTraffic:
+    """Requests, blocked requests and downloaded bytes of the browser pages, read from the performance log."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = self.requests = self.blocked = self.downloaded_bytes = 0
+
+    def record_page(self, web_driver, url: str):
+        requests_sent = blocked = downloaded_bytes = 0
+        for entry in web_driver.get_log('performance'):
+            message = json.loads(entry['message'])['message']
+            method = message.get('method')
+            params = message.get('params', {})
+            if method == 'Network.requestWillBeSent':
+                requests_sent += 1
+            elif method == 'Network.loadingFinished':
+                downloaded_bytes += params.get('encodedDataLength', 0)
+            elif method == 'Network.loadingFailed' and params.get('blockedReason'):
+                blocked += 1
+
+        with self.lock:
+            self.pages += 1
+            self.requests += requests_sent
+            self.blocked += blocked
+            self.downloaded_bytes += downloaded_bytes
+        log_and_console_info(f"Browser traffic [requests={requests_sent}, blocked={blocked}, downloaded={downloaded_bytes / 1024:.1f}KB] {url}")
+
+    def log_totals(self):
+        if self.pages:
+            log_and_console_info(f"Browser traffic for {self.pages} pages [requests={self.requests}, blocked={self.blocked}, "
+                                 f"downloaded={self.downloaded_bytes / 1024:.1f}KB, per page={self.downloaded_bytes / self.pages / 1024:.1f}KB]")
+
+
+browser_traffic = BrowserTraffic()
+
+
+def quit_web_driver(web_driver):
+    log_and_console_info("Quiting the webdriver!")
+    try:
+        web_driver.quit()
+    except Exception as ex:
+        log_and_console_error(f"Error quiting the webdriver. {ex}")
 
 
-def quit_web_driver():
-    global web_driver
-    if web_driver != None:
-        log_and_console_info("Quiting Web Driver before starting!")
-        web_driver.quit()
+class WebDriverPool:
+    """Independent Chrome sessions handed out one caller at a time.
+
+    Drivers are started lazily. A driver whose session breaks (see is_broken_session) is quit and
+    replaced on the next checkout, so one crashed browser does not affect the others.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle_drivers = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.drivers = []
+
+    @contextmanager
+    def driver(self):
+        self.slots.acquire()
         web_driver = None
+        broken = False
+        try:
+            try:
+                web_driver = self.idle_drivers.get_nowait()
+            except queue.Empty:
+                web_driver = create_web_driver()
+                with self.lock:
+                    self.drivers.append(web_driver)
+            yield web_driver
+        except Exception as ex:
+            broken = is_broken_session(ex)
+            raise
+        finally:
+            if web_driver is not None:
+                if broken:
+                    log_and_console_error("Web driver failed, it will be replaced.")
+                    with self.lock:
+                        self.drivers.remove(web_driver)
+                    quit_web_driver(web_driver)
+                else:
+                    self.idle_drivers.put(web_driver)
+            self.slots.release()
+
+    def quit_all(self):
+        with self.lock:
+            drivers, self.drivers = self.drivers, []
+        for web_driver in drivers:
+            quit_web_driver(web_driver)
+
+
+class PageTimeoutError(Exception):
+    """A page did not reach a terminal state in time. Not a WebDriverException, so the driver is kept."""
+
 
+# Chrome or chromedriver died or dropped the session. These come as a plain WebDriverException with a message,
+# or as a connection error when chromedriver itself is gone
+BROKEN_SESSION_ERRORS = (InvalidSessionIdException, SessionNotCreatedException, NoSuchWindowException,
+                         MaxRetryError, ProtocolError, ConnectionError)
+BROKEN_SESSION_MESSAGES = ("chrome not reachable", "disconnected", "tab crashed", "session deleted")
 
-def write_into_error_file(input_string: str):
-    log_and_console_error("Writing into the error file!")
 
-    error_file = open(ERROR_FILE, "a")
-    error_file.write(input_string)
-    error_file.write("\n")
-    error_file.close()
+def is_broken_session(error: Exception) -> bool:
+    """True when the driver can not be used again. A failing script or selector leaves the session working."""
+    if isinstance(error, BROKEN_SESSION_ERRORS):
+        return True
+    return type(error) is WebDriverException and any(message in (error.msg or "").lower() for message in BROKEN_SESSION_MESSAGES)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Errors that may not happen again on a retry, as opposed to a page that does not parse or match."""
+    return (isinstance(error, (PageTimeoutError, TimeoutException, requests.exceptions.RequestException, TimeoutError))
+            or is_broken_session(error))
+
+
+class PageLatencyTracker:
+    """Recent load times per page type, used to size the readiness timeouts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, page_type: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(page_type, deque(maxlen=READINESS_SAMPLE_SIZE)).append(seconds)
+
+    def timeout(self, page_type: str) -> float:
+        with self.lock:
+            samples = list(self.samples.get(page_type, []))
+        if len(samples) < READINESS_MIN_SAMPLES:
+            return TIMEOUT_SECONDS
+        p95 = statistics.quantiles(samples, n=20)[-1]
+        return min(TIMEOUT_SECONDS, max(READINESS_MIN_TIMEOUT, p95 * READINESS_TIMEOUT_FACTOR))
+
+
+page_latency_tracker = PageLatencyTracker()
+
+
+def load_page(web_driver, url: str, page_type: str, state_script: str):
+    """Opens the url and returns its terminal state as soon as it appears, raises PageTimeoutError on timeout."""
+    web_driver.execute_script(MARK_STALE_PAGE_SCRIPT)
+    limiter = get_host_limiter(url)
+    with limiter.slot():
+        start = time.monotonic()
+        web_driver.get(url)
+        timeout = page_latency_tracker.timeout(page_type)
+        try:
+            state = WebDriverWait(web_driver, timeout, poll_frequency=READINESS_POLL_SECONDS).until(
+                lambda driver: driver.execute_script(state_script)
+                )
+        except TimeoutException:
+            log_and_console_error(f"Timeout exception occurred in {page_type} page after {timeout:.1f}s.")
+            state = None
+    page_latency_tracker.record(page_type, time.monotonic() - start)
+    if state is None:
+        limiter.record_congestion("page timeout")
+    else:
+        limiter.record_success(time.monotonic() - start, "browser")
+    if LEAN_BROWSER_STATS:
+        browser_traffic.record_page(web_driver, url)
+    if state is None:
+        raise PageTimeoutError(f"The {page_type} page did not load in {timeout:.1f}s. {url}")
+    return state
+
+
+def initiate_web_driver_pool():
+    global web_driver_pool
+    web_driver_pool = WebDriverPool(WEB_DRIVER_POOL_SIZE)
+
+
+def initiate_http_session():
+    global http_session
+
+    log_and_console_info("Getting HTTP session started!")
+    http_session = requests.Session()
+    http_session.headers.update(HTTP_HEADERS)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=1)
+    http_session.mount("http://", adapter)
+    http_session.mount("https://", adapter)
+
+
+class PageCache:
+    """Pages fetched over HTTP, stored compressed in sqlite and evicted least recently used past max_bytes."""
+
+    def __init__(self, filename: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY, status INTEGER, body BLOB, etag TEXT, last_modified TEXT,
+            fetched_at REAL, accessed_at REAL, size INTEGER)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        # url -> last access time not yet written, so a hit is only a read
+        self.accessed = {}
+
+    def get(self, url: str):
+        """Returns the cached entry as a dict, None if the url is not cached."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, body, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self.accessed[url] = time.time()
+            if len(self.accessed) >= CACHE_ACCESS_BATCH_SIZE:
+                self.write_accessed()
+                self.connection.commit()
+        status, body, etag, last_modified, fetched_at = row
+        return {'status': status, 'html': zlib.decompress(body).decode('utf8'), 'etag': etag,
+                'last_modified': last_modified, 'fetched_at': fetched_at}
+
+    def put(self, url: str, status: int, html: str, etag: str, last_modified: str):
+        body = zlib.compress(html.encode('utf8'))
+        now = time.time()
+        with self.lock:
+            # Written first, so eviction sees the latest access times and this page's own time is not overwritten
+            self.write_accessed()
+            old = self.connection.execute("SELECT size FROM pages WHERE url = ?", (url,)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (url, status, body, etag, last_modified, now, now, len(body)))
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            self.connection.commit()
+
+    def refresh(self, url: str):
+        """Marks a revalidated (304) entry as fetched now."""
+        now = time.time()
+        with self.lock:
+            self.write_accessed()
+            self.connection.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self.connection.commit()
+
+    def write_accessed(self):
+        # Called with the lock held, committed by the caller
+        if self.accessed:
+            self.connection.executemany("UPDATE pages SET accessed_at = ? WHERE url = ?",
+                                        [(accessed_at, url) for url, accessed_at in self.accessed.items()])
+            self.accessed = {}
+
+    def evict(self):
+        # Drops the least recently used pages until the cache is back under 90% of its size
+        target = self.max_bytes * 0.9
+        rows = self.connection.execute("SELECT url, size FROM pages ORDER BY accessed_at").fetchall()
+        evicted = []
+        for url, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((url,))
+            self.total_bytes -= size
+        self.connection.executemany("DELETE FROM pages WHERE url = ?", evicted)
+        log_and_console_info(f"Evicted {len(evicted)} pages from the page cache")
+
+    def close(self):
+        with self.lock:
+            self.write_accessed()
+            self.connection.commit()
+            self.connection.close()
+
+
+def initiate_page_cache():
+    global page_cache
+    log_and_console_info(f"Opening page cache {CACHE_FILE}")
+    page_cache = PageCache(CACHE_FILE, CACHE_MAX_BYTES)
+
+
+class ProductUrlIndex:
+    """Normalized SKU -> confirmed product urls, kept as an append-only tab separated file.
+
+    Every line is "key<TAB>url url ...<TAB>confirmed at", the last line of a key wins and
+    a line without urls removes the key. The file is compacted when it is opened.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        line_count = 0
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf8', errors='ignore') as f:
+                for line in f:
+                    splits = line.rstrip('\n').split('\t')
+                    if len(splits) != 3:
+                        continue
+                    line_count += 1
+                    key, urls, confirmed_at = splits
+                    if urls:
+                        self.entries[key] = (urls.split(' '), datetime.fromisoformat(confirmed_at))
+                    else:
+                        self.entries.pop(key, None)
+        if line_count > len(self.entries):
+            self.compact()
+
+    def compact(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w', encoding='utf8') as f:
+            for key, (urls, confirmed_at) in self.entries.items():
+                f.write(f"{key}\t{' '.join(urls)}\t{confirmed_at.isoformat()}\n")
+        os.replace(temp_filename, self.filename)
+
+    def get(self, key: str):
+        """Confirmed urls for the key, None if the key is not indexed or its entry is stale."""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or (datetime.now() - entry[1]).days >= URL_INDEX_MAX_AGE_DAYS:
+            return None
+        return entry[0]
+
+    def put(self, key: str, urls):
+        self.write(key, list(urls), datetime.now())
+
+    def remove(self, key: str):
+        self.write(key, [], datetime.now())
+
+    def write(self, key: str, urls, confirmed_at: datetime):
+        with self.lock:
+            if urls:
+                self.entries[key] = (urls, confirmed_at)
+            elif self.entries.pop(key, None) is None:
+                return
+            with open(self.filename, 'a', encoding='utf8') as f:
+                f.write(f"{key}\t{' '.join(urls)}\t{confirmed_at.isoformat()}\n")
+
+
+def initiate_url_index():
+    global url_index
+    log_and_console_info(f"Opening product url index {URL_INDEX_FILE}")
+    url_index = ProductUrlIndex(URL_INDEX_FILE)
+    log_and_console_info(f"Product url index has {len(url_index.entries)} entries")
+
+
+class SingleFlight:
+    """Runs a call once per key for the whole run; concurrent and later callers get the same result.
+
+    A call that fails is forgotten once its concurrent callers have the error, so a retry runs it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def do(self, key, function, *args):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(function(*args))
+            except Exception as ex:
+                future.set_exception(ex)
+                with self.lock:
+                    self.futures.pop(key, None)
+        else:
+            log_and_console_info(f"Sharing the result already fetched for {key}")
+        return future.result()
+
+
+class HostLimiter:
+    """Requests in flight to one host and the gap between their starts, see USE_ADAPTIVE_HOST_LIMITS."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.condition = threading.Condition()
+        self.limit = float(AIMD_INITIAL_LIMIT if USE_ADAPTIVE_HOST_LIMITS else MAX_REQUESTS_PER_HOST)
+        self.interval = 0.0
+        self.in_flight = 0
+        self.next_start = 0.0
+        # Usual latency per kind of fetch, "http" or "browser", a page load is much slower than a GET
+        self.latency = {}
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.congestions = 0
+        self.throttled_seconds = 0.0
+
+    @contextmanager
+    def slot(self):
+        waiting_since = time.monotonic()
+        with self.condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.condition.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start_at = max(now, self.next_start)
+            self.next_start = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+        with self.condition:
+            self.requests += 1
+            self.throttled_seconds += time.monotonic() - waiting_since
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def record_success(self, seconds: float, kind: str):
+        if not USE_ADAPTIVE_HOST_LIMITS:
+            return
+        with self.condition:
+            latency = self.latency.get(kind)
+            # Slow samples are averaged in too, so a lasting slowdown becomes the usual latency
+            self.latency[kind] = seconds if latency is None else 0.8 * latency + 0.2 * seconds
+            if latency is not None and seconds > latency * AIMD_SLOW_FACTOR:
+                self.decrease_locked(f"slow {kind} response {seconds:.1f}s")
+                return
+            self.limit = min(float(MAX_REQUESTS_PER_HOST), self.limit + 1 / self.limit)
+            self.interval = max(0.0, self.interval - AIMD_INTERVAL_STEP_SECONDS)
+            self.condition.notify_all()
+
+    def record_congestion(self, reason: str):
+        if not USE_ADAPTIVE_HOST_LIMITS:
+            return
+        with self.condition:
+            self.decrease_locked(reason)
+
+    def decrease_locked(self, reason: str):
+        now = time.monotonic()
+        if now - self.last_decrease < AIMD_DECREASE_COOLDOWN_SECONDS:
+            return
+        self.last_decrease = now
+        self.congestions += 1
+        self.limit = max(1.0, self.limit * AIMD_DECREASE_FACTOR)
+        self.interval = min(AIMD_MAX_INTERVAL_SECONDS, self.interval * 2 + AIMD_INTERVAL_STEP_SECONDS)
+        log_and_console_info(f"Slowing down {self.host} [{reason}]: {int(self.limit)} in flight, {self.interval:.2f}s between requests")
+
+    def metrics(self) -> dict:
+        with self.condition:
+            return {'limit': round(self.limit, 2), 'interval_seconds': round(self.interval, 2), 'in_flight': self.in_flight,
+                    'requests': self.requests, 'congestions': self.congestions,
+                    'throttled_seconds': round(self.throttled_seconds, 1)}
+
+
+def get_host_limiter(url: str) -> HostLimiter:
+    host = urlparse(url).netloc
+    with host_limiters_lock:
+        if host not in host_limiters:
+            host_limiters[host] = HostLimiter(host)
+        return host_limiters[host]
+
+
+def get_host_limit_metrics() -> dict:
+    with host_limiters_lock:
+        limiters = list(host_limiters.values())
+    return {limiter.host: limiter.metrics() for limiter in limiters}
+
+
+def log_host_limits():
+    for host, metrics in get_host_limit_metrics().items():
+        log_and_console_info(f"##### {host} : {metrics}")
+
+
+def http_get(url: str, page_type: str):
+    """Returns (status_code, html, from_cache) for the url, or (None, None, False) if the request failed.
+
+    from_cache is True when the page was not sent by the site in this request, either fresh in the cache or not modified.
+    """
+    if http_session is None:
+        initiate_http_session()
+
+    cached = page_cache.get(url) if page_cache is not None else None
+    headers = {}
+    if cached is not None:
+        if time.time() - cached['fetched_at'] < CACHE_TTL_SECONDS.get(page_type, 0):
+            return cached['status'], cached['html'], True
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    limiter = get_host_limiter(url)
+    try:
+        with limiter.slot():
+            start = time.monotonic()
+            response = http_session.get(url, timeout=HTTP_TIMEOUT_SECONDS, headers=headers)
+            elapsed = time.monotonic() - start
+        if response.status_code == 429 or response.status_code >= 500:
+            limiter.record_congestion(f"HTTP {response.status_code}")
+        else:
+            limiter.record_success(elapsed, "http")
+        if response.status_code == 304 and cached is not None:
+            page_cache.refresh(url)
+            return cached['status'], cached['html'], True
+        if page_cache is not None and response.status_code in (200, 404):
+            page_cache.put(url, response.status_code, response.text,
+                           response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.status_code, response.text, False
+    except requests.exceptions.RequestException as ex:
+        limiter.record_congestion(type(ex).__name__)
+        log_and_console_error(f"HTTP request failed for {url}. {ex}")
+        return None, None, False
+
+
+def element_text(element):
+    """Text of a BeautifulSoup element with <br> as line breaks, close to what Selenium's .text returns."""
+    for br in element.find_all("br"):
+        br.replace_with("\n")
+    return element.get_text().strip()
 
 
 # def update_identification_file(prod_id: str):
@@ -148,23 +915,225 @@ def write_into_error_file(input_string: str):
 #             last_id = indent_ids[-1]
 #     return last_id
 
-def update_identification_file(prod_id: str):
-    with open(IDENTIFICATION_FILE, "a", encoding='utf8', errors='ignore') as identification_file:
-        identification_file.write(f"{prod_id}\t{datetime.now()}\n")
-
-def get_identification_value() -> str:
+class CompletionJournal:
+    """Every completed Strike ID, kept in the identification file as "id<TAB>completed at" lines.
+
+    All ids are loaded into a set, so resume skips exactly the completed inputs whatever order
+    they finished in. A line cut short by a crash is dropped when the journal is opened.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.completed = set()
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                data = f.read()
+            complete_length = data.rfind(b'\n') + 1
+            if complete_length < len(data):
+                log_and_console_error(f"Dropping an incomplete line at the end of {filename}")
+                os.truncate(filename, complete_length)
+            for line in data[:complete_length].decode('utf8', errors='ignore').splitlines():
+                strike_id = line.split('\t')[0].strip()
+                if strike_id:
+                    self.completed.add(strike_id)
+        self.file = open(filename, 'a', encoding='utf8', errors='ignore')
+
+    def __contains__(self, strike_id: str) -> bool:
+        return strike_id in self.completed
+
+    def __len__(self) -> int:
+        return len(self.completed)
+
+    def add_many(self, strike_ids, fsync: bool = False):
+        completed_at = datetime.now()
+        with self.lock:
+            self.file.write("".join(f"{strike_id}\t{completed_at}\n" for strike_id in strike_ids))
+            self.file.flush()
+            if fsync:
+                os.fsync(self.file.fileno())
+            self.completed.update(strike_ids)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+completion_journal = None
+
+
+def open_completion_journal():
+    global completion_journal
     log_and_console_info(f"Opening identification file {IDENTIFICATION_FILE}")
-    if os.path.exists(IDENTIFICATION_FILE):
-        with open(IDENTIFICATION_FILE, 'r', encoding='utf8', errors='ignore') as f:
-            lines = f.readlines()
-            if lines:
-                return lines[-1].split('\t')[0]
-    return 'none'
+    completion_journal = CompletionJournal(IDENTIFICATION_FILE)
 
 
-def create_output_file():
-    if(not os.path.exists(OUTPUT_FILE)):
-        output_file = open(OUTPUT_FILE, "a")
+def to_float(value: str):
+    try:
+        return float(value.replace("$", "").replace(",", ""))
+    except (AttributeError, ValueError):
+        return None
+
+
+class ResultStore:
+    """Crawled results in sqlite: a results row per Strike ID and an offers row per (Strike ID, offer)."""
+
+    def __init__(self, filename: str):
+        self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                strike_id TEXT PRIMARY KEY, sku TEXT, brand TEXT, mpn TEXT, model TEXT, upc TEXT, asin TEXT,
+                my_price REAL, status TEXT, offer_count INTEGER, crawled_at TEXT, my_price_text TEXT);
+            CREATE TABLE IF NOT EXISTS offers (
+                strike_id TEXT, offer_index INTEGER, price REAL, price_text TEXT, condition TEXT, availability TEXT,
+                PRIMARY KEY (strike_id, offer_index));
+            """)
+        # Stores created before My Price was also kept as written in the input
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(results)")]
+        if 'my_price_text' not in columns:
+            self.connection.execute("ALTER TABLE results ADD COLUMN my_price_text TEXT")
+        self.connection.commit()
+
+    def upsert_many(self, results):
+        """Writes [(request, response_list)] in one transaction, replacing the earlier offers of the same ids."""
+        crawled_at = str(datetime.now())
+        result_rows = []
+        offer_rows = []
+        for request, response_list in results:
+            status = "FOUND" if len(response_list) else "NOT FOUND"
+            result_rows.append((request.strike_id, request.sku, request.brand, request.mpn, request.model, request.upc,
+                                request.asin, to_float(request.price), status, len(response_list), crawled_at, request.price))
+            for offer_index, res in enumerate(response_list, start=1):
+                offer_rows.append((request.strike_id, offer_index, to_float(res.price), res.price, res.condition, res.availability))
+
+        with self.connection:
+            self.connection.executemany("""
+                INSERT INTO results (strike_id, sku, brand, mpn, model, upc, asin, my_price, status, offer_count, crawled_at, my_price_text)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (strike_id) DO UPDATE SET sku = excluded.sku, brand = excluded.brand, mpn = excluded.mpn,
+                    model = excluded.model, upc = excluded.upc, asin = excluded.asin, my_price = excluded.my_price,
+                    status = excluded.status, offer_count = excluded.offer_count, crawled_at = excluded.crawled_at,
+                    my_price_text = excluded.my_price_text
+                """, result_rows)
+            self.connection.executemany("DELETE FROM offers WHERE strike_id = ?", [(row[0],) for row in result_rows])
+            self.connection.executemany("INSERT INTO offers VALUES (?, ?, ?, ?, ?, ?)", offer_rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class ResultWriter:
+    """Single writer of the output, identification and error files, committing buffered lines in groups."""
+
+    def __init__(self, journal: CompletionJournal, store: ResultStore, batch_size: int, flush_seconds: float, fsync: bool,
+                 output_filename: str = None, error_filename: str = None):
+        self.journal = journal
+        self.store = store
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.output_rows = []
+        self.results = []
+        self.error_lines = []
+        self.output_file = open(output_filename or OUTPUT_FILE, "a", encoding='utf8', errors='ignore')
+        self.error_file = open(error_filename or ERROR_FILE, "a")
+        self.stopped = threading.Event()
+        self.flush_thread = threading.Thread(target=self.flush_periodically, args=(flush_seconds,), name="result-writer", daemon=True)
+        self.flush_thread.start()
+
+    def write_output(self, request: Request, response_list):
+        with self.lock:
+            self.output_rows.append(get_output_row(request, response_list))
+            self.results.append((request, response_list))
+            if len(self.output_rows) >= self.batch_size:
+                self.commit()
+
+    def write_error(self, input_string: str):
+        with self.lock:
+            self.error_lines.append(f"{input_string}\n")
+            if len(self.error_lines) >= self.batch_size:
+                self.commit()
+
+    def flush(self):
+        with self.lock:
+            self.commit()
+
+    def flush_periodically(self, flush_seconds: float):
+        while not self.stopped.wait(flush_seconds):
+            self.flush()
+
+    def commit(self):
+        # Output rows reach the disk before their ids, an id is never written for a row that is missing
+        if self.output_rows:
+            self.output_file.write("".join(self.output_rows))
+            self.sync(self.output_file)
+            if self.store is not None:
+                self.store.upsert_many(self.results)
+            self.journal.add_many([request.strike_id for request, response_list in self.results], self.fsync)
+            self.output_rows = []
+            self.results = []
+        if self.error_lines:
+            self.error_file.write("".join(self.error_lines))
+            self.sync(self.error_file)
+            self.error_lines = []
+
+    def sync(self, file):
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def close(self):
+        self.stopped.set()
+        self.flush_thread.join()
+        with self.lock:
+            self.commit()
+            self.output_file.close()
+            self.error_file.close()
+            if self.store is not None:
+                self.store.close()
+
+
+result_writer = None
+
+
+def open_result_writer():
+    global result_writer
+    store = None
+    if USE_RESULT_STORE:
+        log_and_console_info(f"Opening result store {RESULT_DB}")
+        store = ResultStore(RESULT_DB)
+    result_writer = ResultWriter(completion_journal, store, WRITER_BATCH_SIZE, WRITER_FLUSH_SECONDS, WRITER_FSYNC)
+
+
+def remove_uncommitted_output_rows(journal: CompletionJournal, output_filename: str = None):
+    """Drops the rows at the end of the output whose ids never reached the identification file."""
+    output_filename = output_filename or OUTPUT_FILE
+    if not os.path.exists(output_filename):
+        return
+    committed_length = offset = uncommitted_rows = 0
+    with open(output_filename, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            strike_id = line.split(b'\t', 1)[0].decode('utf8', errors='ignore').strip()
+            if line.endswith(b'\n') and (strike_id == "Strike ID" or strike_id in journal):
+                committed_length = offset
+                uncommitted_rows = 0
+            else:
+                uncommitted_rows += 1
+    if not uncommitted_rows:
+        return
+    if uncommitted_rows > WRITER_BATCH_SIZE:
+        # More than one batch can not come from a crash, the identification file was probably reset
+        log_and_console_error(f"{uncommitted_rows} rows at the end of {output_filename} are not in {journal.filename}, leaving them as they are.")
+        return
+    log_and_console_info(f"Removing {uncommitted_rows} uncommitted rows from the end of {output_filename}")
+    os.truncate(output_filename, committed_length)
+
+
+def create_output_file(output_filename: str = None):
+    output_filename = output_filename or OUTPUT_FILE
+    if(not os.path.exists(output_filename)):
+        output_file = open(output_filename, "a")
         # Add the headers in the output file
         output_file.write("Strike ID\tSKU\tBrand\tMPN\tModel\tUPC\tAsin\tMy Price\tStatus")
         for i in range(1, 11):
@@ -173,194 +1142,714 @@ def create_output_file():
         output_file.close()
 
 
-def open_inputs_from_file(filename: str):
+def get_input_shards(filename: str, shard_count: int):
+    """Splits the file into shard_count byte ranges [start, end); a line belongs to the range it starts in."""
+    size = os.path.getsize(filename)
+    return [(size * n // shard_count, size * (n + 1) // shard_count) for n in range(shard_count)]
+
+
+def read_input_lines(filename: str, start: int = 0, end: int = None):
+    """Yields the non-empty lines starting inside [start, end) of the file, reading one line at a time."""
+    with open(filename, 'rb') as f:
+        position = start
+        if start > 0:
+            # Skip the line running into the range, it belongs to the previous shard
+            f.seek(start - 1)
+            position = start - 1 + len(f.readline())
+        while end is None or position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                yield line
+
+
+def count_input_lines(filename: str, start: int = 0, end: int = None) -> int:
+    return sum(1 for line in read_input_lines(filename, start, end))
+
+
+def open_inputs_from_file(filename: str, start: int = 0, end: int = None):
+    """Lazily yields (index, Request) for the input lines of the byte range."""
     log_and_console_info(f"Opening input file {filename}")
-    inputs = []
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    for line in lines:
-        if line.strip() not in [None, '']:
-            inputs.append(Request(line))
-    return inputs
-
-def get_product_details(req:Request, prod_url: str):
+    for i, line in enumerate(read_input_lines(filename, start, end)):
+        yield i, Request(line.decode(INPUT_ENCODING, errors='replace'))
+
+NON_ALPHANUMERIC = re.compile('[^a-zA-Z0-9]')
+
+
+def normalize_part_number(value: str) -> str:
+    return NON_ALPHANUMERIC.sub('', value).upper().lstrip("0")
+
+
+def is_sku_match(req: Request, sku: str) -> bool:
+    return normalize_part_number(sku) == req.normalized_sku
+
+
+# A word of 4 or more characters with a digit and a letter or a hyphen, like 01-SSC-1937 or 757120-001, but not a price or 2m
+PART_NUMBER_TEXT = re.compile(r'\b(?=[A-Za-z0-9-]{4,}\b)(?=[A-Za-z0-9-]*[0-9])(?=[A-Za-z0-9-]*[A-Za-z-])[A-Za-z0-9]+(?:-[A-Za-z0-9]+)*\b')
+
+
+def filter_search_candidates(req: Request, search_results, counters: RunCounters = None):
+    """Urls of the search results worth opening for the request, see FILTER_SEARCH_CANDIDATES.
+
+    The pages avoided are counted in counters, the run's counters when it is None.
+    """
+    product_urls = [product_url for product_url, card_text in search_results]
+    if not FILTER_SEARCH_CANDIDATES or not req.normalized_sku or not len(product_urls):
+        return product_urls
+
+    if not any(PART_NUMBER_TEXT.search(card_text) for product_url, card_text in search_results if card_text):
+        log_and_console_info(f"No search result shows a part number, opening all {len(product_urls)}")
+        return product_urls
+
+    candidates = [product_url for product_url, card_text in search_results
+                  if not card_text or req.normalized_sku in NON_ALPHANUMERIC.sub('', card_text).upper()]
+
+    avoided = len(product_urls) - len(candidates)
+    if avoided:
+        log_and_console_info(f"Opening {len(candidates)} of {len(product_urls)} search results, the others do not mention {req.sku}")
+        (counters if counters is not None else run_counters).add('detail_pages_avoided', avoided)
+    return candidates
+
+
+def get_part_number(sku_texts) -> str:
+    for sku_text in sku_texts:
+        if sku_text.lower().__contains__("part number"):
+            return sku_text.split(":")[-1].strip()
+    return ""
+
+
+def get_product_from_page(req: Request, page: dict):
+    """Builds the Product from the fields read off a details page, None if the part number does not match."""
     product = None
     condition = availability = "na"
-    try:
-        log_and_console_info(f"Calling product url - {prod_url}")
-        web_driver.get(prod_url)
-        # time.sleep(30)
-        try:
-            wrapper = WebDriverWait(web_driver, TIMEOUT_SECONDS).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'span.skumodel'))
-                )
-        except TimeoutException:
-            log_and_console_error("Timeout exception occurred in details page.")
-        sku_elements = web_driver.find_elements(By.CSS_SELECTOR, 'span.skumodel')
-        sku = ""
-        for skumodel in sku_elements:
-            if skumodel.text.lower().__contains__("part number"):
-                sku = skumodel.text.split(":")[-1].strip()
+    sku = page['sku']
+
+    if is_sku_match(req, sku):
+        price = page['price']
+        if not price:
+            raise ValueError("Price not found in the details page.")
+
+        for spec_text in page['specs']:
+            # log_and_console_info(b_text)
+            if spec_text.lower().__contains__("condition"):
+                for spec in spec_text.split("\n"):
+                    if spec != "" and spec.__contains__(":"):
+                        k,v = spec.split(":")
+                        if k.lower().strip() == "condition":
+                            condition = v.strip().replace(".","")
+                        if k.lower().strip() == "availability":
+                            availability = v.strip().replace(".","")
+
+                product = Product(price=price, condition=condition, availability=availability)
                 break
+        log_and_console_info(f"Product details [price={price}, condition={condition}, availability={availability}]")
+    else:
+        log_and_console_info(f"MPN mismatch [expected={sku}, found={req.sku}]")
 
-        modified_sku = re.sub('[^a-zA-Z0-9]', '', sku).upper().lstrip("0")
-        modified_req_sku = re.sub('[^a-zA-Z0-9]', '', req.sku).upper().lstrip("0")
-
-        if modified_sku == modified_req_sku:
-
-            ## Getting edtails from the right corner
-            # price = web_driver.find_element(By.CSS_SELECTOR, 'span.pricebig.protected').text.replace("$","").replace(",","")
-            # table_rows = web_driver.find_elements(By.CSS_SELECTOR,'section.section-content > div.container > div.row > div > div.card > table > tbody > tr')
-            # for tr in table_rows:
-            #     tds = tr.find_elements(By.CSS_SELECTOR, 'td')
-            #     if len(tds) == 2:
-            #         if tds[1].text.lower().__contains__("condition"):
-            #             condition = tds[1].text.split(":")[-1].strip()
-            #         elif tds[1].text.lower().__contains__("availability"):
-            #             availability = tds[1].text.split(":")[-1].strip()
-
-            #     if condition != "na" and availability != "na":
-            #         break
-            # product = Product(price=price, condition=condition, availability=availability)
-            li_elements = web_driver.find_elements(By.CSS_SELECTOR, 'div.card-body.detail_overviewd > li')
-            spec_elements = []
-            if len(li_elements):                
-                spec_elements = li_elements
-            else:
-                spec_elements = web_driver.find_elements(By.CSS_SELECTOR, 'div.card-body.detail_overviewd > p')
-        
-            price = web_driver.find_element(By.CSS_SELECTOR, 'span.pricebig.protected').text.replace("$","").replace(",","")
-            
-            for spec in spec_elements:
-                spec_text = spec.text
-                # log_and_console_info(b_text)
-                if spec_text.lower().__contains__("condition"):                
-                    for spec in spec_text.split("\n"):
-                        if spec != "" and spec.__contains__(":"):
-                            k,v = spec.split(":")
-                            if k.lower().strip() == "condition":
-                                condition = v.strip().replace(".","")
-                            if k.lower().strip() == "availability":
-                                availability = v.strip().replace(".","")
-                    
-                    product = Product(price=price, condition=condition, availability=availability)
-                    break
-            log_and_console_info(f"Product details [price={price}, condition={condition}, availability={availability}]")
+    return product
+
+
+def parse_product_page(html: str):
+    """Reads the details page fields from static html, None if the page does not have them."""
+    soup = BeautifulSoup(html, "html.parser")
+    sku = get_part_number([element_text(el) for el in soup.select('span.skumodel')])
+    if sku == "":
+        return None
+
+    price_element = soup.select_one('span.pricebig.protected')
+    price = element_text(price_element).replace("$","").replace(",","") if price_element is not None else ""
+    if price == "":
+        # Price is filled in by javascript on some pages
+        return None
+
+    spec_elements = soup.select('div.card-body.detail_overviewd > li')
+    if not len(spec_elements):
+        spec_elements = soup.select('div.card-body.detail_overviewd > p')
+
+    return {'sku': sku, 'price': price, 'specs': [element_text(el) for el in spec_elements]}
+
+
+# Fields of a details page that does not exist, matches no request
+NOT_FOUND_PAGE = {'sku': "", 'price': None, 'specs': []}
+
+
+def read_product_page_from_browser(web_driver, req: Request, prod_url: str) -> dict:
+    """Reads the details page fields. With a request, price and specs are only read when the part matches."""
+    if load_page(web_driver, prod_url, "details", DETAILS_PAGE_STATE_SCRIPT) == "not_found":
+        return NOT_FOUND_PAGE
+    if SCRIPT_EXTRACTION:
+        fields = web_driver.execute_script(DETAILS_PAGE_FIELDS_SCRIPT)
+        price = fields['price']
+        return {'sku': get_part_number(fields['sku_texts']),
+                'price': price.replace("$","").replace(",","") if price is not None else None,
+                'specs': fields['specs']}
+
+    sku = get_part_number([el.text for el in web_driver.find_elements(By.CSS_SELECTOR, 'span.skumodel')])
+    page = {'sku': sku, 'price': None, 'specs': []}
+
+    # Every lookup is a round trip to the driver, so they are skipped for a part that does not match
+    if req is None or is_sku_match(req, sku):
+        li_elements = web_driver.find_elements(By.CSS_SELECTOR, 'div.card-body.detail_overviewd > li')
+        spec_elements = []
+        if len(li_elements):
+            spec_elements = li_elements
         else:
-            log_and_console_info(f"MPN mismatch [expected={sku}, found={req.sku}]")           
-            
+            spec_elements = web_driver.find_elements(By.CSS_SELECTOR, 'div.card-body.detail_overviewd > p')
+
+        price_elements = web_driver.find_elements(By.CSS_SELECTOR, 'span.pricebig.protected')
+        if len(price_elements):
+            page['price'] = price_elements[0].text.replace("$","").replace(",","")
+        page['specs'] = [spec.text for spec in spec_elements]
+    return page
+
+
+def read_product_page(req: Request, prod_url: str) -> dict:
+    log_and_console_info(f"Calling product url - {prod_url}")
+    page = None
+    if USE_HTTP_FETCH:
+        status, html, from_cache = http_get(prod_url, "details")
+        if status == 404:
+            # A delisted product, the browser would only load the same Not Found page
+            return NOT_FOUND_PAGE
+        if status == 200:
+            page = parse_product_page(html)
+        if page is None:
+            log_and_console_info(f"Details page did not parse over HTTP [status={status}], falling back to the browser.")
+    if page is None:
+        with web_driver_pool.driver() as web_driver:
+            page = read_product_page_from_browser(web_driver, req, prod_url)
+    return page
+
+
+NOT_FOUND_TITLE = re.compile(r'<title>\s*not found\s*</title>', re.IGNORECASE)
+
+
+def parse_search_page(html: str, page_url: str):
+    """Returns [(product url, card text)] of a search page from static html, None if the page does not parse."""
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text().strip() if soup.title is not None else ""
+    if title.lower() == "not found":
+        return []
+
+    result_element = soup.select_one('section.section-content.bg.padding-y')
+    if result_element is None:
+        return None
+
+    search_results = []
+    if result_element.select_one('article.card.card-product') is not None:
+        # layout one
+        search_results = soup.select('section.section-content.bg.padding-y div.card-body div.img-wrap')
+    elif result_element.select_one('div.productbox') is not None:
+        # layout two
+        search_results = soup.select('section.section-content.bg.padding-y div.productbox div.imgBox')
+
+    results = []
+    for result in search_results:
+        link = result.select_one('a[href]')
+        if link is None:
+            return None
+        card = result.find_parent('article') or result.find_parent('div', class_='productbox') or result
+        results.append((urljoin(page_url, link['href']), element_text(card)))
+    return results
+
+
+def read_search_page_from_browser(web_driver, search_url: str):
+    state = load_page(web_driver, search_url, "search", SEARCH_PAGE_STATE_SCRIPT)
+    # Not Found is the site's page for a search without results, a page that never renders times out instead
+    if state == "not_found":
+        get_host_limiter(search_url).record_congestion("soft block")
+        return []
+
+    results = []
+    for product_url, card_text in web_driver.execute_script(SEARCH_RESULTS_SCRIPT):
+        if product_url is None:
+            raise ValueError("Search result without a product link.")
+        results.append((product_url, card_text or ""))
+    return results
+
+
+def get_search_results(search_url: str):
+    """Returns [(product url, card text)] of the search page, in listing order."""
+    search_results = None
+    if USE_HTTP_FETCH:
+        status, html, from_cache = http_get(search_url, "search")
+        # A search always has a results page, a missing one is taken as the site pushing back, unless it was cached
+        if not from_cache and (status == 404 or (status == 200 and NOT_FOUND_TITLE.search(html))):
+            get_host_limiter(search_url).record_congestion("soft block")
+        if status == 404:
+            return []
+        if status == 200:
+            search_results = parse_search_page(html, search_url)
+        if search_results is None:
+            log_and_console_info(f"Search page did not parse over HTTP [status={status}], falling back to the browser.")
+    if search_results is None:
+        with web_driver_pool.driver() as web_driver:
+            search_results = read_search_page_from_browser(web_driver, search_url)
+    return search_results
+
+
+def raise_for_transient_status(status: int, url: str):
+    # A failed request, 429 or 5xx fails the input as a transient error instead of reading as no results
+    if status is None or status == 429 or status >= 500:
+        raise requests.exceptions.HTTPError(f"HTTP request failed [status={status}]. {url}")
+
+
+class SiteAdapter(ABC):
+    """What the crawl pipeline needs to know about a site. Pages are read over HTTP unless a site overrides the readers.
+
+    max_concurrency is the number of inputs of the site crawled at the same time by the multi-site engine.
+    """
+    name = None
+    max_concurrency = 4
+
+    @abstractmethod
+    def build_search_url(self, request: Request) -> str:
+        pass
+
+    @abstractmethod
+    def parse_search_page(self, html: str, page_url: str):
+        """Returns [(product url, card text)], None if the page does not parse."""
+
+    @abstractmethod
+    def parse_detail_page(self, html: str):
+        """Returns the fields of a details page as a dict, None if the page does not parse."""
+
+    @abstractmethod
+    def match(self, request: Request, page: dict):
+        """Returns the Product of the page when it is the requested part, None otherwise."""
+
+    def get_search_results(self, search_url: str):
+        status, html, from_cache = http_get(search_url, "search")
+        raise_for_transient_status(status, search_url)
+        if status != 200:
+            return []
+        return self.parse_search_page(html, search_url) or []
+
+    def filter_candidates(self, request: Request, search_results, counters: RunCounters):
+        return [product_url for product_url, card_text in search_results]
+
+    def read_detail_page(self, product_url: str):
+        """Returns the fields of a details page, shared by every input that finds the url."""
+        status, html, from_cache = http_get(product_url, "details")
+        raise_for_transient_status(status, product_url)
+        if status != 200:
+            return None
+        return self.parse_detail_page(html)
+
+
+class ServerSupplyAdapter(SiteAdapter):
+    """serversupply.com, read over HTTP with the browser as fallback."""
+    name = "serversupply"
+    max_concurrency = MAX_REQUESTS_PER_HOST
+
+    def build_search_url(self, request: Request) -> str:
+        return SEARCH_URL + request.mpn.strip()
+
+    def parse_search_page(self, html: str, page_url: str):
+        return parse_search_page(html, page_url)
+
+    def parse_detail_page(self, html: str):
+        return parse_product_page(html)
+
+    def match(self, request: Request, page: dict):
+        product = get_product_from_page(request, page)
+        if product is not None and product.price != "na":
+            return product
+        return None
+
+    def get_search_results(self, search_url: str):
+        return get_search_results(search_url)
+
+    def filter_candidates(self, request: Request, search_results, counters: RunCounters):
+        return filter_search_candidates(request, search_results, counters)
+
+    def read_detail_page(self, product_url: str):
+        # The page is shared by every input that finds this url, so all of its fields are read
+        return read_product_page(None, product_url)
+
+
+class SiteState:
+    """What the pipeline keeps of one site during a run.
+
+    Its url index, counters, writer and retry queue, the searches and details pages shared by its inputs and
+    the pool the details pages of an input are read on. The crawler has one for serversupply, see initiate_site_state.
+    """
+
+    def __init__(self, adapter: SiteAdapter, url_index: ProductUrlIndex, counters: RunCounters, writer, retry_queue):
+        self.adapter = adapter
+        self.url_index = url_index
+        self.counters = counters
+        self.writer = writer
+        self.retry_queue = retry_queue
+        self.search_flights = SingleFlight()
+        self.detail_page_flights = SingleFlight()
+        self.detail_executor = None
+        self.detail_executor_lock = threading.Lock()
+
+    def get_detail_executor(self):
+        with self.detail_executor_lock:
+            if self.detail_executor is None:
+                # Separate from the input level pools, so a search never waits on a thread its own caller holds
+                self.detail_executor = ThreadPoolExecutor(max_workers=DETAIL_PAGE_CONCURRENCY,
+                                                          thread_name_prefix=f"{self.adapter.name}-detail-page")
+            return self.detail_executor
+
+    def close(self):
+        if self.detail_executor is not None:
+            self.detail_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def initiate_site_state():
+    global site_state
+    site_state = SiteState(ServerSupplyAdapter(), url_index, run_counters, result_writer, retry_queue)
+
+
+def get_product_details(site: SiteState, req: Request, prod_url: str):
+    """The Product of a details page for the request, None when the page is not the requested part."""
+    adapter = site.adapter
+    product = None
+    try:
+        if USE_SINGLE_FLIGHT:
+            page = site.detail_page_flights.do(prod_url, adapter.read_detail_page, prod_url)
+        else:
+            page = adapter.read_detail_page(prod_url)
+
+        product = adapter.match(req, page) if page is not None else None
 
     except Exception as ex:
-        log_and_console_error(f"Exception occurred while getting the details of the product. {prod_url}")
+        if is_transient_error(ex):
+            # The input fails as a whole and is retried, instead of reporting the page as no match
+            raise
+        log_and_console_error(f"[{adapter.name}] Exception occurred while getting the details of the product. {prod_url}")
         logging.error(ex, exc_info=True)
     return product
 
+
+def get_products_details(site: SiteState, request: Request, product_urls):
+    """Product (or None) for every url, in the same order as product_urls."""
+    if DETAIL_PAGE_CONCURRENCY <= 1 or len(product_urls) <= 1:
+        return [get_product_details(site, request, detail_url) for detail_url in product_urls]
+    return list(site.get_detail_executor().map(lambda detail_url: get_product_details(site, request, detail_url), product_urls))
+
+
+def get_found_products(site: SiteState, request: Request, product_urls):
+    """Returns [(url, product)] of the detail pages that matched the request, in listing order."""
+    found = []
+    for detail_url, product in zip(product_urls, get_products_details(site, request, product_urls)):
+        if product is not None:
+            found.append((detail_url, product))
+    return found
+
+
+def scrape_site(site: SiteState, request: Request):
+    """Returns the products of the site matching the request, in listing order."""
+    adapter = site.adapter
+    found = []
+    index_key = request.normalized_sku
+    indexed_urls = site.url_index.get(index_key) if site.url_index is not None else None
+    if indexed_urls:
+        log_and_console_info(f"[{adapter.name}] Using {len(indexed_urls)} indexed product urls for {request.sku}")
+        found = get_found_products(site, request, indexed_urls)
+        if not len(found):
+            log_and_console_info(f"[{adapter.name}] Indexed product urls no longer match {request.sku}, searching again.")
+            site.url_index.remove(index_key)
+
+    if not len(found):
+        search_url = adapter.build_search_url(request)
+        log_and_console_info(f"[{adapter.name}] Search URL is {search_url}")
+        if USE_SINGLE_FLIGHT:
+            search_results = site.search_flights.do(request.normalized_mpn, adapter.get_search_results, search_url)
+        else:
+            search_results = adapter.get_search_results(search_url)
+        found = get_found_products(site, request, adapter.filter_candidates(request, search_results, site.counters))
+        if site.url_index is not None and len(found):
+            site.url_index.put(index_key, [detail_url for detail_url, product in found])
+
+    return [product for detail_url, product in found]
+
+
 def scrape_product(request : Request):
-    product_list = []
     try:
-        search_url = SEARCH_URL + request.mpn.strip()
-        log_and_console_info(f"Search URL is {search_url}")
-        web_driver.get(search_url)
-        time.sleep(1)
-        if web_driver.title.lower() == "not found":
-            return product_list
-        
-        try:
-            wrapper = WebDriverWait(web_driver, TIMEOUT_SECONDS).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'section.section-content.bg.padding-y'))
-                )
-        except TimeoutException:
-            log_and_console_error("Timeout exception occurred in search page.")
-            # check for div.productbox
-        result_element = web_driver.find_elements(By.CSS_SELECTOR,'section.section-content.bg.padding-y')
-        if len(result_element):
-            search_results = []
-            if len(result_element[0].find_elements(By.CSS_SELECTOR, 'article.card.card-product')):
-                # layout one
-                search_results = web_driver.find_elements(By.CSS_SELECTOR, 'section.section-content.bg.padding-y div.card-body div.img-wrap')
-            elif len(result_element[0].find_elements(By.CSS_SELECTOR, 'div.productbox')):
-                # layout two
-                search_results = web_driver.find_elements(By.CSS_SELECTOR, 'section.section-content.bg.padding-y div.productbox div.imgBox')
-
-            product_urls = []
-            for result in search_results:
-                product_urls.append(result.find_element(By.CSS_SELECTOR, 'a').get_attribute("href"))
-            for detail_url in product_urls:
-                product = get_product_details(request, detail_url)
-                if product is not None and product.price != "na":
-                    product_list.append(product)
-
+        product_list = scrape_site(site_state, request)
     except Exception as ex:
+        # A failed search is an error of the input, never a NOT FOUND
         log_and_console_error(f"Exception occurred {ex}")
+        raise
 
     log_and_console_info(f"Number of products found is {len(product_list)}")
 
     return product_list
 
+def get_pending_inputs(inputs, journal: CompletionJournal, counters: RunCounters = None):
+    """Yields (index, request) of the inputs not yet completed in the identification file."""
+    for i, request in inputs:
+        if request.strike_id in journal:
+            (counters if counters is not None else run_counters).add('skipped')
+            continue  # Skipping the input, it is already written in identification file
+        yield i, request
+
+
+def get_output_row(request: Request, response_list) -> str:
+    response_str = ""
+    if len(response_list):
+        response_str = "FOUND"
+        for res in response_list:
+            response_str = "\t".join([response_str, res.price, res.condition, res.availability])
+    else:
+        response_str = "NOT FOUND"
+    # Strike ID	SKU	Brand	MPN	Model	UPC	Asin
+    return f"{request.strike_id}\t{request.sku}\t{request.brand}\t{request.mpn}\t{request.model}\t{request.upc}\t{request.asin}\t{request.price}\t{response_str}\n"
+
+
+def process_request(index: int, total_input_count: int, request: Request):
+    """Crawls one input and returns the products found."""
+    log_and_console_info(f"################ Processing input {index+1} of {total_input_count} ################")
+    log_and_console_info(f"Searching product with Strike_id={request.strike_id}, sku={request.sku} , brand={request.brand}, MPN={request.mpn}, UPC={request.upc}, ASIN={request.asin}")
+
+    #################################   Extract Details   #################################
+    start = datetime.now()
+    response_list = scrape_product(request)
+    log_and_console_info(f'Time taken to scrape this product {datetime.now() - start}')
+    return response_list
+
+
+class RetryQueue:
+    """Inputs waiting for a retry after a transient error, ordered by the time they are due."""
+
+    def __init__(self, budget: int, base_seconds: float, max_seconds: float):
+        self.budget = budget
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.due = []
+        self.sequence = itertools.count()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.due)
+
+    def add(self, request: Request) -> bool:
+        """Schedules the next attempt of the input, False when its retry budget is spent."""
+        with self.lock:
+            attempt = self.attempts.get(request.strike_id, 0) + 1
+            if attempt > self.budget:
+                return False
+            self.attempts[request.strike_id] = attempt
+            # Jitter keeps the retries of a burst of failures apart
+            delay = min(self.max_seconds, self.base_seconds * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+            heapq.heappush(self.due, (time.monotonic() + delay, next(self.sequence), request))
+            log_and_console_info(f"Retry {attempt} of {self.budget} for {request.strike_id} in {delay:.0f}s")
+            return True
+
+    def take_due(self):
+        """Waits until the earliest retry is due and returns every input due by then."""
+        with self.lock:
+            if not self.due:
+                return []
+            wait = self.due[0][0] - time.monotonic()
+        if wait > 0:
+            log_and_console_info(f"Waiting {wait:.0f}s for the next retries")
+            time.sleep(wait)
+        requests_due = []
+        with self.lock:
+            now = time.monotonic()
+            while self.due and self.due[0][0] <= now:
+                requests_due.append(heapq.heappop(self.due)[2])
+        return requests_due
+
+
+retry_queue = None
+
+
+def initiate_retry_queue():
+    global retry_queue
+    retry_queue = RetryQueue(RETRY_BUDGET, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+
+
+def complete_request(request: Request, response_list, error: Exception, site: SiteState = None):
+    """Writes the result of an input, or schedules its retry, for the site, the crawler's own when it is None."""
+    site = site if site is not None else site_state
+    if error is not None:
+        log_and_console_error(f"[{site.adapter.name}] Error searching the product. {error}")
+        if is_transient_error(error) and site.retry_queue is not None and site.retry_queue.add(request):
+            site.counters.add('retries')
+            return
+        log_and_console_error("Writing into the error file!")
+        site.writer.write_error(request.input_string)
+        site.counters.add('errors')
+        return
+
+    # The row and its identification line are committed together by the writer
+    site.writer.write_output(request, response_list)
+    site.counters.add('found' if len(response_list) else 'not_found')
+
+
+class OutputSequencer:
+    """Passes finished requests to complete_request, in input order when ORDERED_OUTPUT is set."""
+
+    def __init__(self):
+        self.completed = {}
+        self.next_position = 0
+
+    def add(self, position: int, request: Request, response_list: str, error: Exception):
+        if not ORDERED_OUTPUT:
+            complete_request(request, response_list, error)
+            return
+
+        # Hold the finished rows until every row before them is written
+        self.completed[position] = (request, response_list, error)
+        while self.next_position in self.completed:
+            complete_request(*self.completed.pop(self.next_position))
+            self.next_position += 1
+
+
+def crawl_serial(pending, total_input_count: int):
+    for i, request in pending:
+        response_list = error = None
+        try:
+            response_list = process_request(i, total_input_count, request)
+        except Exception as ex:
+            error = ex
+        complete_request(request, response_list, error)
+
+
+async def crawl_async(pending, total_input_count: int):
+    """Keeps CONCURRENT_REQUESTS inputs in flight; results are written from the event loop only."""
+    loop = asyncio.get_running_loop()
+    sequencer = OutputSequencer()
+
+    with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
+
+        async def crawl_one(position: int, index: int, request: Request):
+            try:
+                response_list = await loop.run_in_executor(executor, process_request, index, total_input_count, request)
+                return position, request, response_list, None
+            except Exception as ex:
+                return position, request, None, ex
+
+        async def complete_some(in_flight):
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                sequencer.add(*task.result())
+            return in_flight
+
+        # Inputs are taken from the pending generator only as slots free up
+        in_flight = set()
+        for position, (i, request) in enumerate(pending):
+            if len(in_flight) >= CONCURRENT_REQUESTS:
+                in_flight = await complete_some(in_flight)
+            in_flight.add(asyncio.create_task(crawl_one(position, i, request)))
+        while in_flight:
+            in_flight = await complete_some(in_flight)
+
+
+def crawl_workers(pending, total_input_count: int):
+    """WORKER_COUNT threads pull inputs from a shared queue, the main thread writes every result."""
+    # Bounded, so the pending generator is only read as fast as the workers take inputs
+    input_queue = queue.Queue(maxsize=WORKER_COUNT * 2)
+    result_queue = queue.Queue()
+
+    def feeder():
+        for position, (i, request) in enumerate(pending):
+            input_queue.put((position, i, request))
+        for _ in range(WORKER_COUNT):
+            input_queue.put(None)
+
+    def worker():
+        while True:
+            item = input_queue.get()
+            if item is None:
+                result_queue.put(None)
+                return
+            position, i, request = item
+            try:
+                result_queue.put((position, request, process_request(i, total_input_count, request), None))
+            except Exception as ex:
+                result_queue.put((position, request, None, ex))
+
+    workers = [threading.Thread(target=worker, name=f"crawler-worker-{n + 1}", daemon=True) for n in range(WORKER_COUNT)]
+    workers.append(threading.Thread(target=feeder, name="crawler-feeder", daemon=True))
+    for thread in workers:
+        thread.start()
+
+    sequencer = OutputSequencer()
+    running_workers = WORKER_COUNT
+    while running_workers:
+        result = result_queue.get()
+        if result is None:
+            running_workers -= 1
+            continue
+        sequencer.add(*result)
+
+    for thread in workers:
+        thread.join()
+
+
+def crawl(pending, total_input_count: int):
+    if RUN_MODE == "async":
+        log_and_console_info(f"Crawling {total_input_count} inputs with {CONCURRENT_REQUESTS} concurrent requests")
+        asyncio.run(crawl_async(pending, total_input_count))
+    elif RUN_MODE == "workers":
+        log_and_console_info(f"Crawling {total_input_count} inputs with {WORKER_COUNT} workers")
+        crawl_workers(pending, total_input_count)
+    else:
+        crawl_serial(pending, total_input_count)
+
+
+def crawl_with_retries(crawl_pass, pending, total_input_count: int, retry_queue: RetryQueue):
+    """Runs crawl_pass(pending, total_input_count), then passes over the retries until the retry queue is empty."""
+    crawl_pass(pending, total_input_count)
+    # Retries of the inputs that failed on a transient error; failing again puts them back in the queue
+    while len(retry_queue):
+        retries = retry_queue.take_due()
+        log_and_console_info(f"Retrying {len(retries)} inputs")
+        crawl_pass(enumerate(retries), len(retries))
+
+
 def main():
-    pid = 0
     try:
         logging.basicConfig(filename='app_log.txt', format='%(asctime)s %(message)s', level=logging.INFO)
         program_start_time = datetime.now()
         log_and_console_info(f"##### Starting the crawling at {program_start_time}")
+        initiate_run_counters()
 
         # Create the output file with headers
         create_output_file()
 
-        # Returns 'none' if there is no identification file created
-        last_id = get_identification_value()
-        log_and_console_info(f'Identification file last id : {last_id}')
-
-        inputs = open_inputs_from_file(INPUT_FILE)
-        total_input_count = len(inputs)
-        initiate_web_driver()
-        # Looping the list of inputs as range to get the index of the input
-        for i in range(len(inputs)):
-            request = inputs[i]
-            ###################### Identification block ######################
-            # If last_id is 'none' [identification file not created] or 'found_last_value' [last value in identification is ound in input file], then start program
-            # If last_id is a valid input id and matched with input list, then set found_last_value to last_id
-            if(last_id != 'none' and last_id != 'found_last_value'):
-                if(last_id != request.strike_id):
-                    continue  # Skipping the input if that is not the last value written in identification file
-                elif(last_id == request.strike_id):
-                    last_id = 'found_last_value'
-                    continue  # Setting new value and Skipping the input last value, if that is the last value written in identification file
-
-            log_and_console_info(f"################ Processing input {i+1} of {total_input_count} ################")
-            
-            pid = pid + 1          
-
-            log_and_console_info(f"Searching product with Strike_id={request.strike_id}, sku={request.sku} , brand={request.brand}, MPN={request.mpn}, UPC={request.upc}, ASIN={request.asin}")
-
-            #################################   Extract Details   #################################
-            start = datetime.now()
-
-            try:
-                response_list = scrape_product(request)
-                response_str = ""
-                if len(response_list):
-                    response_str = "FOUND"
-                    for res in response_list:
-                        response_str = "\t".join([response_str, res.price, res.condition, res.availability])
-                else:
-                    response_str = "NOT FOUND"                
-
-                output_file = open(OUTPUT_FILE, "a", encoding='utf8', errors='ignore')
-                # Strike ID	SKU	Brand	MPN	Model	UPC	Asin
-                output_file.write(f"{request.strike_id}\t{request.sku}\t{request.brand}\t{request.mpn}\t{request.model}\t{request.upc}\t{request.asin}\t{request.price}\t{response_str}\n")
-                output_file.close()
-
-                log_and_console_info(f'Time taken to scrape this product {datetime.now() - start}')
-
-                # Updating the identification file with the sku
-                update_identification_file(request.strike_id)
-            except Exception as ex:
-                log_and_console_error(f"Error searching the product. {ex}")
-                write_into_error_file(request.input_string)
+        open_completion_journal()
+        log_and_console_info(f'Identification file completed inputs : {len(completion_journal)}')
+        remove_uncommitted_output_rows(completion_journal)
+        open_result_writer()
+
+        start, end = get_input_shards(INPUT_FILE, INPUT_SHARD_COUNT)[INPUT_SHARD_INDEX]
+        if INPUT_SHARD_COUNT > 1:
+            log_and_console_info(f"Crawling shard {INPUT_SHARD_INDEX + 1} of {INPUT_SHARD_COUNT} [bytes {start} to {end}]")
+        total_input_count = count_input_lines(INPUT_FILE, start, end)
+        run_counters.set('inputs', total_input_count)
+        pending = get_pending_inputs(open_inputs_from_file(INPUT_FILE, start, end), completion_journal)
+        if USE_HTTP_FETCH:
+            initiate_http_session()
+            if USE_PAGE_CACHE:
+                initiate_page_cache()
+        if USE_URL_INDEX:
+            initiate_url_index()
+        initiate_web_driver_pool()
+
+        initiate_retry_queue()
+        initiate_site_state()
+
+        crawl_with_retries(crawl, pending, total_input_count, retry_queue)
 
         log_and_console_info(f"##### Program execution time is {datetime.now() - program_start_time}")
 
+        result_writer.flush()
+        run_counters.save()
+        run_counters.log()
+        browser_traffic.log_totals()
+        log_host_limits()
         print_data_count()
 
     except Exception as error:
@@ -368,9 +1857,18 @@ def main():
         logging.error(error, exc_info=True)
     finally:
         log_and_console_info('Quiting the program!')
-        if(web_driver != None):
-            log_and_console_info('Quiting the webdriver!')
-            web_driver.quit()
+        if(web_driver_pool != None):
+            web_driver_pool.quit_all()
+        if(site_state != None):
+            site_state.close()
+        if(http_session != None):
+            http_session.close()
+        if(page_cache != None):
+            page_cache.close()
+        if(result_writer != None):
+            result_writer.close()
+        if(completion_journal != None):
+            completion_journal.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,169 @@
+import re
+import json
+import logging
+import threading
+from bs4 import BeautifulSoup
+from datetime import datetime
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+# The serversupply crawler is the engine's library: HTTP session, page cache, browser pool, request parsing,
+# the output, identification and error writer and the crawl pipeline a SiteAdapter is run through all come from it.
+import techforless_comp_serversupply_price_crawler_v1_4 as crawler
+from techforless_comp_serversupply_price_crawler_v1_4 import (Request, Product, SiteAdapter, ServerSupplyAdapter,
+                                                              log_and_console_info, log_and_console_error)
+
+# Every site in SITES is crawled for each input of the same input file, all at the same time.
+# A site keeps its own files, named after it (serversupply_output.txt, serversupply_identification.txt, ...).
+SITES = ["serversupply", "123office"]
+INPUT_FILE = crawler.INPUT_FILE
+
+
+NON_DIGIT = re.compile('[^0-9]')
+
+
+def normalize_upc(value) -> str:
+    """A UPC or GTIN as its digits without leading zeros, 757120003946.0 -> 757120003946."""
+    value = re.sub(r'\.0+$', '', str(value or "").strip())
+    return NON_DIGIT.sub('', value).lstrip('0')
+
+
+class OneTwoThreeOfficeAdapter(SiteAdapter):
+    """123office.com, a BigCommerce store: the product fields are in the page's BCData script. Matched on UPC or GTIN."""
+    name = "123office"
+    max_concurrency = 2
+
+    def build_search_url(self, request: Request) -> str:
+        return f"https://123office.com/search.php?search_query={quote(request.mpn.strip())}&section=product"
+
+    def parse_search_page(self, html: str, page_url: str):
+        soup = BeautifulSoup(html, "html.parser")
+        return [(link['href'], "") for link in soup.select('a.product-item-photo[href]') if link['href'].startswith('http')]
+
+    def parse_detail_page(self, html: str):
+        soup = BeautifulSoup(html, "html.parser")
+        for script in soup.find_all('script', type='text/javascript'):
+            if 'var BCData' in script.text:
+                product_data = json.loads(script.text.split("= ")[1].split("};")[0] + "}")
+                return product_data.get('product_attributes', {})
+        return None
+
+    def match(self, request: Request, page: dict):
+        # The input file generator writes UPCs as floats, 757120003946.0
+        upc = normalize_upc(request.upc)
+        page_codes = [normalize_upc(page.get(key)) for key in ('upc', 'gtin')]
+        if upc == "" or upc not in page_codes:
+            log_and_console_info(f"UPC mismatch [expected={request.upc}, found={'/'.join(page_codes)}]")
+            return None
+
+        price = ((page.get('price') or {}).get('without_tax') or {}).get('value')
+        if price is None:
+            raise ValueError("Price not found in the details page.")
+        availability = "In Stock" if page.get('instock') else "Out of Stock"
+        return Product(price=str(price), availability=availability)
+
+
+SITE_ADAPTERS = {adapter.name: adapter for adapter in (ServerSupplyAdapter(), OneTwoThreeOfficeAdapter())}
+
+
+class SiteRun(crawler.SiteState):
+    """The pipeline state of one site in the run, with its own files named after it (serversupply_url_index.txt, ...)."""
+
+    def __init__(self, adapter: SiteAdapter):
+        output_filename = f"{adapter.name}_{crawler.OUTPUT_FILE}"
+        crawler.create_output_file(output_filename)
+        self.journal = crawler.CompletionJournal(f"{adapter.name}_{crawler.IDENTIFICATION_FILE}")
+        crawler.remove_uncommitted_output_rows(self.journal, output_filename)
+        store = crawler.ResultStore(f"{adapter.name}_{crawler.RESULT_DB}") if crawler.USE_RESULT_STORE else None
+        writer = crawler.ResultWriter(self.journal, store, crawler.WRITER_BATCH_SIZE, crawler.WRITER_FLUSH_SECONDS,
+                                      crawler.WRITER_FSYNC, output_filename, f"{adapter.name}_{crawler.ERROR_FILE}")
+        counters = crawler.RunCounters(f"{adapter.name}_{crawler.STATS_FILE}")
+        url_index = crawler.ProductUrlIndex(f"{adapter.name}_{crawler.URL_INDEX_FILE}") if crawler.USE_URL_INDEX else None
+        retry_queue = crawler.RetryQueue(crawler.RETRY_BUDGET, crawler.RETRY_BASE_SECONDS, crawler.RETRY_MAX_SECONDS)
+        super().__init__(adapter, url_index, counters, writer, retry_queue)
+
+    def close(self):
+        super().close()
+        self.counters.save()
+        self.writer.close()
+        self.journal.close()
+
+
+def crawl_inputs(site: SiteRun, pending, total_input_count: int):
+    """Crawls the (index, request) of pending on one site, max_concurrency inputs at a time."""
+    adapter = site.adapter
+    # Inputs are read only as fast as the site takes them
+    in_flight = threading.BoundedSemaphore(adapter.max_concurrency * 2)
+
+    def crawl_one(i: int, request: Request):
+        response_list = error = None
+        try:
+            log_and_console_info(f"[{adapter.name}] Processing input {i+1} of {total_input_count}, Strike_id={request.strike_id}")
+            response_list = crawler.scrape_site(site, request)
+        except Exception as ex:
+            error = ex
+        try:
+            crawler.complete_request(request, response_list, error, site)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=adapter.max_concurrency, thread_name_prefix=adapter.name) as executor:
+        for i, request in pending:
+            in_flight.acquire()
+            executor.submit(crawl_one, i, request)
+
+
+def crawl_site(site: SiteRun, total_input_count: int):
+    """Crawls every pending input of the input file on one site, then its retries."""
+    pending = crawler.get_pending_inputs(crawler.open_inputs_from_file(INPUT_FILE), site.journal, site.counters)
+    crawler.crawl_with_retries(lambda inputs, input_count: crawl_inputs(site, inputs, input_count),
+                               pending, total_input_count, site.retry_queue)
+
+
+def main():
+    sites = []
+    try:
+        logging.basicConfig(filename='app_log.txt', format='%(asctime)s %(message)s', level=logging.INFO)
+        program_start_time = datetime.now()
+        log_and_console_info(f"##### Starting the crawling of {', '.join(SITES)} at {program_start_time}")
+
+        # One connection pool, page cache and browser pool for all the sites
+        crawler.initiate_http_session()
+        if crawler.USE_PAGE_CACHE:
+            crawler.initiate_page_cache()
+        crawler.initiate_web_driver_pool()
+
+        total_input_count = crawler.count_input_lines(INPUT_FILE)
+        for name in SITES:
+            site = SiteRun(SITE_ADAPTERS[name])
+            site.counters.set('inputs', total_input_count)
+            sites.append(site)
+
+        # A thread per site, each one with its own pool of max_concurrency workers
+        site_threads = [threading.Thread(target=crawl_site, args=(site, total_input_count), name=f"site-{site.adapter.name}")
+                        for site in sites]
+        for thread in site_threads:
+            thread.start()
+        for thread in site_threads:
+            thread.join()
+
+        log_and_console_info(f"##### Program execution time is {datetime.now() - program_start_time}")
+        for site in sites:
+            log_and_console_info(f"##### {site.adapter.name}: {site.counters.counts}")
+
+    except Exception as error:
+        log_and_console_error(f'Error occurred {error}')
+        logging.error(error, exc_info=True)
+    finally:
+        log_and_console_info('Quiting the program!')
+        for site in sites:
+            site.close()
+        if(crawler.web_driver_pool != None):
+            crawler.web_driver_pool.quit_all()
+        if(crawler.http_session != None):
+            crawler.http_session.close()
+        if(crawler.page_cache != None):
+            crawler.page_cache.close()
+
+if __name__ == '__main__':
+    main()